@@ -12,9 +12,13 @@
 
 #For magnetic field experiment, filter out coincidence measurements from both data files and graph them side-by-side 
 
+import os
+
 import streamlit as st 
 from PIL import Image
 
+import perf
+
 
 #page setup: tab icon, page name, sidebar is automatically created
 appicon = Image.open('public/appicon.png')
@@ -27,12 +31,29 @@ st.title("Charm Detection Web App: CosmicWatch Detector Data Analysis")
 st.subheader("A web app developed by Anika Jha from UCI COSMOS with Sophia Shi and Catherine Mai") 
 with st.popover(label="Help", icon=":material/help:"):
     st.markdown("this will explain how to use the app")
-datatype = st.radio(label="Choose detection data type: ", options=["1 detector", "2 detectors", "3 detectors"])
+datatype = st.radio(label="Choose detection data type: ", options=["Detectors (one file per detector)", "Multi-run comparison", "Run catalog"])
+
+#performance instrumentation (off by default, or on with CHARM_PERF=1): times each analysis stage of this rerun
+with st.sidebar:
+    show_perf = st.toggle("Performance instrumentation", value=os.environ.get("CHARM_PERF") == "1")
+    track_memory = show_perf and st.checkbox("Track peak memory (slower)")
+    profile_rerun = show_perf and st.button("Capture full profile of one rerun")
 
 import homepages
-if datatype == "1 detector":
-    homepages.one_home()
-elif datatype == "2 detectors": 
-    homepages.two_home()
-else: 
-    homepages.three_home()
\ No newline at end of file
+pages = {
+    "Detectors (one file per detector)": homepages.detectors_home,
+    "Multi-run comparison": homepages.compare_home,
+    "Run catalog": homepages.catalog_home,
+}
+perf.begin(datatype, show_perf, track_memory)
+profile_path = None
+try:
+    if profile_rerun:
+        profile_path = perf.profile(pages[datatype])
+    else:
+        pages[datatype]()
+finally:
+    # also when the page stops early (st.stop, a rerun or an error), so memory tracing is switched off
+    recorder = perf.end()
+if recorder is not None:
+    homepages.perf_panel(recorder, profile_path)
@@ -0,0 +1,240 @@
+#Online anomaly detection for the live detector feed: rate bursts and drops against the baseline, a detector
+#going silent, shifts of the SiPM spectrum and temperature excursions
+#Each detector keeps a few exponentially weighted sums, so every event costs the same at any rate
+#Run `python anomaly.py` to replay a synthetic stream with injected anomalies and print the alerts
+
+import json
+import math
+import random
+import time
+from datetime import datetime
+
+#Time constants in seconds of the current rate (short), the current SiPM spectrum and the baseline (long)
+SHORT_TAU = 10.0
+SPECTRUM_TAU = 30.0
+BASELINE_TAU = 600.0
+#Significance in standard deviations at which an alert is raised, and below which it is cleared again
+RAISE_SIGMA = 5.0
+CLEAR_SIGMA = 2.0
+#A detector is silent after this many mean baseline intervals without an event (chance e^-15 for a Poisson stream)
+SILENCE_INTERVALS = 15.0
+#Difference in degrees C between the current and the baseline temperature that counts as an excursion
+TEMPERATURE_LIMIT = 3.0
+#Seconds of data before any alert is raised, so the baseline can settle
+WARMUP = 2 * SHORT_TAU
+
+
+class DecayingAverage:
+    """Exponentially weighted mean and variance of irregularly spaced samples, with time constant tau.
+
+    weight is the decayed number of samples, so it also gives a running rate estimate (see rate()).
+    """
+
+    def __init__(self, tau):
+        self.tau = tau
+        self.weight = 0.0
+        self.mean = 0.0
+        self.var = 0.0
+        self.start = None
+        self.t = None
+
+    def decayed_weight(self, t):
+        if self.t is None:
+            return 0.0
+        return self.weight * math.exp(-max(t - self.t, 0.0) / self.tau)
+
+    def window(self, t):
+        """Effective length of the average at time t: tau, or less while the stream is younger than a few tau."""
+        if self.start is None:
+            return 0.0
+        return self.tau * -math.expm1(-max(t - self.start, 0.0) / self.tau)
+
+    def rate(self, t):
+        """Samples per second at time t."""
+        window = self.window(t)
+        return self.decayed_weight(t) / window if window > 0 else 0.0
+
+    def update(self, t, x):
+        self.weight = self.decayed_weight(t) + 1.0
+        if self.t is None:
+            self.start = t
+        self.t = t if self.t is None else max(t, self.t)
+        # Weighted incremental update (West 1979) with the decayed weight of the old samples
+        share = 1.0 / self.weight
+        delta = x - self.mean
+        self.mean += share * delta
+        self.var = (1.0 - share) * (self.var + share * delta * delta)
+
+
+class DetectorMonitor:
+    """Online detectors of one detector's stream. update() and check() return the alerts raised or cleared."""
+
+    def __init__(self, name, short_tau=SHORT_TAU, spectrum_tau=SPECTRUM_TAU, baseline_tau=BASELINE_TAU):
+        self.name = name
+        self.short_count = DecayingAverage(short_tau)
+        self.short_sipm = DecayingAverage(spectrum_tau)
+        self.long_sipm = DecayingAverage(baseline_tau)
+        self.short_temperature = DecayingAverage(short_tau)
+        self.long_temperature = DecayingAverage(baseline_tau)
+        self.start = None
+        self.last = None
+        self.active = {}  # kind -> alert that raised it
+
+    def _alert(self, kind, raise_it, clear_it, t, **fields):
+        """Raise kind when raise_it and it is not active yet, clear it when clear_it and it is active."""
+        if kind not in self.active and raise_it:
+            alert = dict(type="alert", detector=self.name, kind=kind, state="raised", time=t, **fields)
+            self.active[kind] = alert
+            return [alert]
+        if kind in self.active and clear_it:
+            del self.active[kind]
+            return [dict(type="alert", detector=self.name, kind=kind, state="cleared", time=t, **fields)]
+        return []
+
+    def _averages(self):
+        return [self.short_count, self.short_sipm, self.long_sipm, self.short_temperature, self.long_temperature]
+
+    def update(self, t, sipm, temperature):
+        """Add one event at time t in seconds."""
+        if self.start is None:
+            self.start = t
+        alerts = self._alert("silence", False, True, t)
+        if alerts:
+            # Leave the silent period out of the averages, otherwise the baseline rate is dragged down by it
+            # and the normal rate after it looks like a burst
+            gap = t - self.last
+            for average in self._averages():
+                average.t += gap
+                average.start += gap
+            self.start += gap
+        self.last = t
+        # Baseline as it was before this event, so a burst is compared with the time before it
+        baseline = self.long_sipm.rate(t)
+        for average, value in zip(self._averages(), [1.0, sipm, sipm, temperature, temperature]):
+            average.update(t, value)
+        if t - self.start < WARMUP or baseline <= 0:
+            return alerts
+
+        # Rate: for a Poisson stream of rate r the decayed count has mean r*tau and variance r*tau/2
+        # (ignoring the event just added, which is what triggered the evaluation)
+        window = self.short_count.window(t)
+        expected = baseline * window
+        rate_sigma = (self.short_count.weight - 1.0 - expected) / math.sqrt(expected / 2)
+        rate_fields = dict(rate=self.short_count.rate(t), baseline=baseline, sigma=rate_sigma)
+        alerts += self._alert("rate_burst", rate_sigma > RAISE_SIGMA, rate_sigma < CLEAR_SIGMA, t, **rate_fields)
+        alerts += self._alert("rate_drop", rate_sigma < -RAISE_SIGMA, rate_sigma > -CLEAR_SIGMA, t, **rate_fields)
+
+        # SiPM spectrum: current mean against the baseline, in units of the standard error of the current mean
+        spread = math.sqrt(self.long_sipm.var / self.short_sipm.weight)
+        if spread > 0:
+            sipm_sigma = (self.short_sipm.mean - self.long_sipm.mean) / spread
+            alerts += self._alert("sipm_shift", abs(sipm_sigma) > RAISE_SIGMA, abs(sipm_sigma) < CLEAR_SIGMA, t,
+                                  sipm=self.short_sipm.mean, baseline=self.long_sipm.mean, sigma=sipm_sigma)
+
+        # Temperature: current against baseline in degrees
+        excursion = self.short_temperature.mean - self.long_temperature.mean
+        alerts += self._alert("temperature", abs(excursion) > TEMPERATURE_LIMIT, abs(excursion) < TEMPERATURE_LIMIT / 2, t,
+                              temperature=self.short_temperature.mean, baseline=self.long_temperature.mean)
+        return alerts
+
+    def check(self, now):
+        """Alerts that do not need an event: a detector that stopped sending."""
+        if self.last is None or now - self.start < WARMUP:
+            return []
+        baseline = self.long_sipm.rate(self.last)
+        quiet = baseline > 0 and (now - self.last) * baseline > SILENCE_INTERVALS
+        return self._alert("silence", quiet, False, now, silent_for=now - self.last, baseline=baseline)
+
+
+def parse_frame(message):
+    """Host time in seconds, SiPM voltage, temperature and detector name (None if absent) of a live-feed line.
+
+    The line is 'YYYY-MM-DD HH:MM:SS.ffffff event ardn_time adc sipm deadtime temperature [name]'.
+    Returns None for lines that are not events (headers, empty lines).
+    """
+    fields = message.split()
+    if len(fields) < 8:
+        return None
+    try:
+        t = datetime.fromisoformat(fields[0] + " " + fields[1]).timestamp()
+        return t, float(fields[5]), float(fields[7]), fields[8] if len(fields) > 8 else None
+    except ValueError:
+        return None
+
+
+class StreamMonitor:
+    """DetectorMonitor of every detector seen in the feed."""
+
+    def __init__(self, **options):
+        self.options = options
+        self.detectors = {}
+
+    def update(self, name, t, sipm, temperature):
+        if name not in self.detectors:
+            self.detectors[name] = DetectorMonitor(name, **self.options)
+        return self.detectors[name].update(t, sipm, temperature)
+
+    def update_frame(self, message, default_name="detector"):
+        """update() from one live-feed line, see parse_frame."""
+        event = parse_frame(message)
+        if event is None:
+            return []
+        t, sipm, temperature, name = event
+        return self.update(name or default_name, t, sipm, temperature)
+
+    def check(self, now):
+        alerts = []
+        for monitor in self.detectors.values():
+            alerts += monitor.check(now)
+        return alerts
+
+
+def synthetic_stream(duration=6000.0, rate=2.0, seed=1):
+    """(time, sipm, temperature) of a Poisson stream with four injected anomalies; returns the events and
+    the (start, kind) of each anomaly: a 10x burst, a 300 s silence, a +50% SiPM shift and a +5 C step."""
+    rng = random.Random(seed)
+    anomalies = [(1000.0, "rate_burst"), (2000.0, "silence"), (3000.0, "sipm_shift"), (4000.0, "temperature")]
+    events = []
+    t = 0.0
+    while t < duration:
+        burst = 1000.0 <= t < 1020.0
+        t += rng.expovariate(rate * (10 if burst else 1))
+        if 2000.0 <= t < 2300.0:
+            t = 2300.0 + rng.expovariate(rate)
+        gain = 1.5 if 3000.0 <= t < 3200.0 else 1.0
+        sipm = gain * (20.0 + rng.expovariate(1 / 30.0))  # rough shape of a SiPM spectrum
+        temperature = 22.0 + (5.0 if 4000.0 <= t < 4400.0 else 0.0) + rng.gauss(0, 0.1)
+        events.append((t, sipm, temperature))
+    return events, anomalies
+
+
+if __name__ == "__main__":
+    events, anomalies = synthetic_stream()
+    monitor = StreamMonitor()
+    alerts = []
+    tick = 0.0
+    started = time.perf_counter()
+    for t, sipm, temperature in events:
+        while tick + 0.1 <= t:  # the live server checks for silence every 100 ms
+            tick += 0.1
+            alerts += monitor.check(tick)
+        alerts += monitor.update("synthetic", t, sipm, temperature)
+    elapsed = time.perf_counter() - started
+    print("Injected:", ", ".join(f"{kind} at {start:.0f} s" for start, kind in anomalies))
+    for alert in alerts:
+        print(json.dumps({key: round(value, 2) if isinstance(value, float) else value for key, value in alert.items()}))
+    raised = [alert for alert in alerts if alert["state"] == "raised"]
+    found = all(any(alert["kind"] == kind and start <= alert["time"] < start + 60 for alert in raised)
+                for start, kind in anomalies)
+    false = [alert for alert in raised
+             if not any(alert["kind"] == kind and start <= alert["time"] < start + 60 for start, kind in anomalies)]
+    print(f"All anomalies found within 60 s: {found}; other alerts raised: {len(false)}")
+
+    # Cost per event does not depend on the rate: time a dense stream
+    events, _ = synthetic_stream(duration=2000.0, rate=500.0)
+    monitor = StreamMonitor()
+    started = time.perf_counter()
+    for t, sipm, temperature in events:
+        monitor.update("synthetic", t, sipm, temperature)
+    elapsed = time.perf_counter() - started
+    print(f"{len(events)} events in {elapsed:.2f} s: {elapsed / len(events) * 1e6:.1f} us per event")
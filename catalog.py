@@ -0,0 +1,222 @@
+#Catalog of the runs in a data directory on the server, kept in a local SQLite index
+#A scan parses every new or changed run once, records its metadata and saves its events as a .npy file,
+#so opening a run afterwards is a memory map instead of a browser upload and a parse
+#Re-scans only look at files whose size or modification time changed
+#Plain-text runs also get their time index (see timeindex.py), so a time window of a run is parsed on its own
+
+import hashlib
+import io
+import os
+import sqlite3
+
+import numpy as np
+
+import clockalign
+import dataparser
+import timeindex
+
+#Directory the recorders write to, and where the index and the parsed events are kept
+DATA_DIR = os.environ.get("CHARM_DATA_DIR", "data")
+CATALOG_DIR = os.environ.get("CHARM_CATALOG_DIR", os.path.join(DATA_DIR, ".catalog"))
+#File names of runs: recorded text, also gzip- or zstd-compressed (see dataparser.open_run)
+RUN_SUFFIXES = (".txt", ".gz", ".zst")
+
+COLUMNS = ["path", "size", "mtime_ns", "device_id", "start_ns", "end_ns", "events", "mean_rate",
+           "temperature_min", "temperature_max", "data_offset", "events_file", "index_file", "error"]
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    path TEXT PRIMARY KEY,   -- relative to the data directory
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    device_id TEXT,
+    start_ns INTEGER,        -- first and last valid host time stamp
+    end_ns INTEGER,
+    events INTEGER,
+    mean_rate REAL,          -- events per second of Arduino time
+    temperature_min REAL,
+    temperature_max REAL,
+    data_offset INTEGER,     -- byte offset of the first data line in the run's text
+    events_file TEXT,        -- parsed events in the catalog directory, see load()
+    index_file TEXT,         -- time-index sidecar next to the run, relative to the data directory, see load_range()
+    error TEXT               -- why the run could not be parsed; it is tried again once the file changes
+)"""
+
+
+def connect(catalog_dir=CATALOG_DIR):
+    os.makedirs(catalog_dir, exist_ok=True)
+    connection = sqlite3.connect(os.path.join(catalog_dir, "catalog.sqlite"))
+    connection.execute(SCHEMA)
+    # A catalog written with other columns is rebuilt from scratch: the next scan parses every run again
+    if [column for _, column, *_ in connection.execute("PRAGMA table_info(runs)")] != COLUMNS:
+        with connection:
+            connection.execute("DROP TABLE runs")
+            connection.execute(SCHEMA)
+    return connection
+
+
+def _run_files(data_dir, catalog_dir):
+    """Relative path -> (size, mtime_ns) of every run file under data_dir."""
+    files = {}
+    skip = os.path.abspath(catalog_dir)
+    for root, dirs, names in os.walk(data_dir):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != skip]
+        for name in names:
+            if name.endswith(RUN_SUFFIXES):
+                path = os.path.join(root, name)
+                status = os.stat(path)
+                files[os.path.relpath(path, data_dir)] = (status.st_size, status.st_mtime_ns)
+    return files
+
+
+def _header(path):
+    """Device ID and byte length of the header of a run."""
+    with open(path, "rb") as stream:
+        text = io.BufferedReader(dataparser.open_run(stream))
+        head = [text.readline() for _ in range(dataparser.HEADER_SEARCH_LINES)]
+    header_lines = dataparser.count_header_lines(head)
+    device_id = None
+    if header_lines:
+        device_id = head[header_lines - 1].decode("utf-8", "replace").split(":", 1)[-1].strip().rstrip(",")
+    return device_id, sum(len(line) for line in head[:header_lines])
+
+
+def summarize(path, events_path):
+    """Parse one run, save its events to events_path and return its metadata columns (see COLUMNS)."""
+    try:
+        device_id, data_offset = _header(path)
+        with open(path, "rb") as stream:
+            plain = timeindex.is_plain(stream.read(4))
+            stream.seek(0)
+            data = dataparser.parse_run(stream)
+    except Exception as error:  # anything a damaged file can raise (zstandard.ZstdError, ...) must not stop the scan
+        return dict(events=0, error=f"{type(error).__name__}: {error}")
+    index_file = None
+    if plain:
+        try:
+            timeindex.load_index(path)  # a sidecar left from a replaced run is rebuilt, see timeindex.matches
+            index_file = timeindex.index_path(path)
+        except OSError:
+            pass  # read-only data directory: time windows are cut from the parsed events instead
+    # Write then rename, so a reader never maps a half-written file
+    np.save(events_path + ".tmp.npy", data)
+    os.replace(events_path + ".tmp.npy", events_path)
+    host = data["host_time_ns"][data["host_time_ns"] != dataparser.MISSING_TIME]
+    time_ms = clockalign.unwrap_ms(data["ardn_time_ms"])
+    span_s = (time_ms[-1] - time_ms[0]) / 1000 if len(time_ms) > 1 else 0
+    return dict(
+        device_id=device_id,
+        start_ns=int(host.min()) if len(host) else None,
+        end_ns=int(host.max()) if len(host) else None,
+        events=len(data),
+        mean_rate=(len(data) - 1) / span_s if span_s > 0 else None,
+        temperature_min=float(data["temperature"].min()) if len(data) else None,
+        temperature_max=float(data["temperature"].max()) if len(data) else None,
+        data_offset=data_offset,
+        index_file=index_file,
+        error=None,
+    )
+
+
+def _events_name(path):
+    return hashlib.blake2b(path.encode(), digest_size=8).hexdigest() + ".npy"
+
+
+def scan(data_dir=DATA_DIR, catalog_dir=CATALOG_DIR, pool=None):
+    """Bring the catalog up to date with data_dir, parsing on pool (an executor such as detectorpool.make_pool
+    returns; in this process if None). Returns the number of runs added, updated, removed,
+    unchanged and failed (all runs in the catalog that could not be parsed)."""
+    connection = connect(catalog_dir)
+    known = {path: (size, mtime_ns, events_file) for path, size, mtime_ns, events_file
+             in connection.execute("SELECT path, size, mtime_ns, events_file FROM runs")}
+    files = _run_files(data_dir, catalog_dir)
+    changed = [path for path, status in files.items() if known.get(path, (None, None))[:2] != status]
+    removed = [path for path in known if path not in files]
+
+    # Step 1: parse the new and changed runs, on the worker processes if there are any
+    events_files = [_events_name(path) for path in changed]
+    paths = [os.path.join(data_dir, path) for path in changed]
+    events_paths = [os.path.join(catalog_dir, name) for name in events_files]
+    if pool is None or len(changed) <= 1:
+        summaries = [summarize(path, events_path) for path, events_path in zip(paths, events_paths)]
+    else:
+        summaries = list(pool.map(summarize, paths, events_paths))
+
+    # Step 2: record them, and forget the runs that are gone
+    with connection:
+        for path, events_file, summary in zip(changed, events_files, summaries):
+            row = dict.fromkeys(COLUMNS)
+            row.update(summary, path=path, size=files[path][0], mtime_ns=files[path][1],
+                       events_file=None if summary["error"] else events_file,
+                       index_file=summary.get("index_file") and os.path.relpath(summary["index_file"], data_dir))
+            connection.execute(f"INSERT OR REPLACE INTO runs VALUES ({', '.join('?' * len(COLUMNS))})",
+                               [row[column] for column in COLUMNS])
+        for path in removed:
+            connection.execute("DELETE FROM runs WHERE path = ?", (path,))
+            if known[path][2]:
+                try:
+                    os.remove(os.path.join(catalog_dir, known[path][2]))
+                except FileNotFoundError:
+                    pass
+    # Runs that failed in an earlier scan and have not changed since still count
+    failed, = connection.execute("SELECT COUNT(*) FROM runs WHERE error IS NOT NULL").fetchone()
+    connection.close()
+    new = sum(path not in known for path in changed)
+    return dict(added=new, updated=len(changed) - new, removed=len(removed), unchanged=len(files) - len(changed),
+                failed=failed)
+
+
+def runs(catalog_dir=CATALOG_DIR, device_id=None, start_ns=None, end_ns=None, min_events=0):
+    """Rows of the catalog as dicts, oldest first: the parsed runs of device_id (all if None) that were
+    recording at some point between start_ns and end_ns and have at least min_events events."""
+    query = "SELECT * FROM runs WHERE error IS NULL AND events >= ?"
+    args = [min_events]
+    if device_id is not None:
+        query += " AND device_id = ?"
+        args.append(device_id)
+    if start_ns is not None:
+        query += " AND end_ns >= ?"
+        args.append(start_ns)
+    if end_ns is not None:
+        query += " AND start_ns <= ?"
+        args.append(end_ns)
+    connection = connect(catalog_dir)
+    rows = [dict(zip(COLUMNS, row)) for row in connection.execute(query + " ORDER BY start_ns, path", args)]
+    connection.close()
+    return rows
+
+
+def devices(catalog_dir=CATALOG_DIR):
+    connection = connect(catalog_dir)
+    names = [name for name, in connection.execute(
+        "SELECT DISTINCT device_id FROM runs WHERE device_id IS NOT NULL ORDER BY device_id")]
+    connection.close()
+    return names
+
+
+def load(row, catalog_dir=CATALOG_DIR):
+    """Events of a catalogued run, memory-mapped read-only: pages are read from disk as they are used
+    and shared by every session and process that opens the same run."""
+    return np.load(os.path.join(catalog_dir, row["events_file"]), mmap_mode="r")
+
+
+def load_index(row, data_dir=DATA_DIR):
+    """Time index of a catalogued run (see timeindex.py), None if it has none."""
+    if not row["index_file"]:
+        return None
+    return timeindex.read_index(os.path.join(data_dir, row["index_file"]))
+
+
+def load_range(row, axis, start, end, data_dir=DATA_DIR, catalog_dir=CATALOG_DIR):
+    """Events of a catalogued run with start <= time <= end on the axis ("host" or "ardn", see timeindex.py).
+
+    Runs with a time index only parse the slice of their text around the window; the others are cut from
+    their memory-mapped events.
+    """
+    if row["index_file"]:
+        return timeindex.load_range(os.path.join(data_dir, row["path"]), axis, start, end)
+    return timeindex.trim(load(row, catalog_dir), axis, start, end)
+
+
+def run_key(row):
+    """Dataset cache key of a catalogued run; changes when the file does."""
+    return f"catalog:{row['path']}:{row['size']}:{row['mtime_ns']}"
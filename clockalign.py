@@ -0,0 +1,131 @@
+#Alignment of the detectors' Arduino clocks on one common timebase
+#Every Arduino counts millis() on its own oscillator, so the clocks of several detectors drift apart by seconds
+#over a long run. The host clock is shared: each Arduino clock is fitted against it piecewise-linearly, with the
+#median host-Arduino offset of each segment as knot, which ignores serial latency spikes and the odd NTP step.
+#The fit can then be refined with coincident events, which pins the detectors to each other to the ms.
+
+import numpy as np
+
+from dataparser import MISSING_TIME
+
+#Length in seconds of Arduino time of the segments with one knot each
+SEGMENT_SECONDS = 600
+#Segments with fewer events with a host time get no knot of their own
+MIN_SEGMENT_EVENTS = 20
+#Coincidence refinement: starting half-width of the window around the current offset, halved each iteration
+#down to REFINE_MIN_WINDOW_MS; segments need MIN_PAIRS matched events for a knot
+REFINE_WINDOW_MS = 50
+REFINE_MIN_WINDOW_MS = 2
+REFINE_ITERATIONS = 5
+MIN_PAIRS = 5
+
+WRAP_MS = 1 << 32
+
+
+def unwrap_ms(ardn_time_ms):
+    """Arduino times as int64, continuing past the uint32 wrap of millis() after 49.7 days."""
+    time_ms = ardn_time_ms.astype(np.int64)
+    wraps = np.flatnonzero(np.diff(time_ms) < -(WRAP_MS // 2)) + 1
+    for start in wraps:
+        time_ms[start:] += WRAP_MS
+    return time_ms
+
+
+def _segment_medians(segments, values):
+    """Segment ids (non-negative ints), median of values and number of values in each segment."""
+    order = np.lexsort((values, segments))
+    segments = segments[order]
+    values = values[order]
+    ids, starts, counts = np.unique(segments, return_index=True, return_counts=True)
+    medians = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+    return ids, medians, counts
+
+
+def _interpolate(x, knots):
+    """Piecewise-linear curve through knots ((2, k) array of x and y), extended linearly beyond the end knots."""
+    knot_x, knot_y = knots
+    if len(knot_x) == 0:
+        return np.zeros(len(x))
+    y = np.interp(x, knot_x, knot_y)
+    if len(knot_x) > 1:
+        head = (knot_y[1] - knot_y[0]) / (knot_x[1] - knot_x[0])
+        tail = (knot_y[-1] - knot_y[-2]) / (knot_x[-1] - knot_x[-2])
+        y = np.where(x < knot_x[0], knot_y[0] + (x - knot_x[0]) * head, y)
+        y = np.where(x > knot_x[-1], knot_y[-1] + (x - knot_x[-1]) * tail, y)
+    return y
+
+
+def fit_clock(time_ms, host_time_ns, segment_seconds=SEGMENT_SECONDS):
+    """Knots of the host-Arduino offset in ms against Arduino time, as a (2, n_knots) array.
+
+    time_ms: unwrapped Arduino times (see unwrap_ms); events without a host time are left out of the fit.
+    Arduino time goes back after a reset mid-run, or when one file interleaves the clocks of several
+    detectors (mode 1); like the bins of the pipeline, events before the first one are left out as well.
+    """
+    if not len(time_ms):
+        return np.empty((2, 0))
+    valid = (host_time_ns != MISSING_TIME) & (time_ms >= time_ms[0])
+    x = time_ms[valid]
+    if not len(x):
+        return np.empty((2, 0))
+    offset = host_time_ns[valid] / 1e6 - x
+    segments = (x - x[0]) // int(segment_seconds * 1000)
+    ids, medians, counts = _segment_medians(segments, offset)
+    # The knot of a segment sits at its mean Arduino time, where the median offset applies best
+    centers = np.bincount(segments, weights=x)[ids] / counts
+    keep = counts >= MIN_SEGMENT_EVENTS
+    if not keep.any():
+        keep = counts == counts.max()  # short run: one knot from the fullest segment
+    return np.vstack([centers[keep], medians[keep]])
+
+
+def apply_clock(time_ms, knots):
+    """Arduino times converted to the host timebase, int64 ms since 1970-01-01 like host_time_ns / 1e6.
+
+    Without knots (a run with no host time at all) the Arduino times are returned unchanged.
+    """
+    return np.rint(time_ms + _interpolate(time_ms, knots)).astype(np.int64)
+
+
+def coincidence_knots(reference_ms, other_ms, window_ms=REFINE_WINDOW_MS, segment_seconds=SEGMENT_SECONDS):
+    """Knots of the remaining offset of other against reference, from their coincident events.
+
+    Both are times on the common timebase, in order except after an Arduino reset, so reference is sorted
+    here and other need not be. Every event of other is matched with the nearest event of
+    reference; accidental matches spread evenly over the window while true coincidences pile up at the offset,
+    so the median within a window that is halved around it each iteration converges on the true offset.
+    Returns a (2, n_knots) array (no knots if there are too few coincidences).
+    """
+    if len(reference_ms) == 0 or len(other_ms) == 0:
+        return np.empty((2, 0))
+    reference_ms = np.sort(reference_ms, kind="stable")  # close to linear on times that are in order already
+    j = np.searchsorted(reference_ms, other_ms)
+    before = other_ms - reference_ms[np.maximum(j - 1, 0)]
+    after = other_ms - reference_ms[np.minimum(j, len(reference_ms) - 1)]
+    difference = np.where(np.abs(before) <= np.abs(after), before, after).astype(np.float64)
+
+    center = 0.0
+    window = float(window_ms)
+    for _ in range(REFINE_ITERATIONS):
+        near = np.abs(difference - center) <= window
+        if near.sum() < MIN_PAIRS:
+            return np.empty((2, 0))
+        center = float(np.median(difference[near]))
+        window = max(window / 2, REFINE_MIN_WINDOW_MS)
+
+    # Per segment, the median of the matches within the final window around the overall offset
+    near = np.flatnonzero(np.abs(difference - center) <= window)
+    x = other_ms[near]
+    segments = (x - x.min()) // int(segment_seconds * 1000)
+    ids, medians, counts = _segment_medians(segments, difference[near])
+    centers = np.bincount(segments, weights=x)[ids] / counts
+    keep = counts >= MIN_PAIRS
+    if not keep.any():
+        return np.array([[float(np.median(x))], [center]])
+    return np.vstack([centers[keep], medians[keep]])
+
+
+def refine(reference_ms, other_ms, window_ms=REFINE_WINDOW_MS, segment_seconds=SEGMENT_SECONDS):
+    """other_ms shifted onto reference_ms by coincidence_knots; unchanged if there are too few coincidences."""
+    knots = coincidence_knots(reference_ms, other_ms, window_ms, segment_seconds)
+    return np.rint(other_ms - _interpolate(other_ms, knots)).astype(np.int64)
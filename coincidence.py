@@ -0,0 +1,63 @@
+#Live coincidence tagging for the recorder: events of different detectors that arrive within a time window
+#of each other get the same group ID, written as an extra last column (0: not coincident)
+#Every event waits one window before it is written, so a partner arriving just after it can still tag it
+
+from collections import deque
+
+#Default coincidence window in seconds (host time stamps, so it has to cover the serial read latency)
+WINDOW = 0.05
+#Most recent events kept per detector for matching; bounds the work per event during bursts
+RING_SIZE = 64
+
+
+class CoincidenceTagger:
+    """Group IDs for the events of n_detectors, assigned as the events arrive (in time order)."""
+
+    def __init__(self, n_detectors, window=WINDOW, ring_size=RING_SIZE):
+        self.window = window
+        self.rings = [deque(maxlen=ring_size) for _ in range(n_detectors)]
+        self.pending = deque()  # every event not written yet, in arrival order: [time, line, group]
+        self.next_group = 1
+        self.events = 0
+        self.coincident_events = 0
+        self.groups = 0
+
+    def add(self, detector, t, line):
+        """Add an event of detector at host time t in seconds; line is written later by ready()."""
+        event = [t, line, 0]
+        for other, ring in enumerate(self.rings):
+            if other == detector:
+                continue
+            # Newest first, up to the first event that is too old: every untagged event of the other detector
+            # within the window joins the group, so a burst of hits on one detector is tagged as a whole
+            for partner in reversed(ring):
+                if t - partner[0] > self.window:
+                    break
+                if event[2] == 0 and partner[2] == 0:
+                    event[2] = partner[2] = self.next_group
+                    self.next_group += 1
+                    self.groups += 1
+                    self.coincident_events += 2
+                elif partner[2] == 0:
+                    partner[2] = event[2]
+                    self.coincident_events += 1
+                elif event[2] == 0:
+                    event[2] = partner[2]
+                    self.coincident_events += 1
+        self.rings[detector].append(event)
+        self.pending.append(event)
+        self.events += 1
+
+    def ready(self, now):
+        """(line, group) of the events that can no longer get a partner, oldest first."""
+        out = []
+        while self.pending and now - self.pending[0][0] > self.window:
+            t, line, group = self.pending.popleft()
+            out.append((line, group))
+        return out
+
+    def drain(self):
+        """(line, group) of every event still waiting, e.g. when the recording stops."""
+        out = [(line, group) for t, line, group in self.pending]
+        self.pending.clear()
+        return out
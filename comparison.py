@@ -0,0 +1,70 @@
+#Comparison of many runs grouped by experimental condition (altitude, shielding, magnetic field, ...)
+#Runs are parsed and binned in the worker processes of detectorpool.make_pool, so the work is spread over all cores
+
+import io
+
+import numpy as np
+import pandas as pd
+
+import clockalign
+import dataparser
+
+
+def bin_run(raw, bin_seconds):
+    """Parse one run from its raw bytes and return its rate in Hz in consecutive bins of bin_seconds.
+
+    Bins start at the first event; the last, incomplete bin is dropped. Events before the first one
+    (an Arduino reset restarts millis() in the middle of a run) fall outside the bins and are left out.
+    """
+    data = dataparser.parse_run(io.BytesIO(raw))
+    if len(data) < 2:
+        return np.empty(0)
+    time_ms = clockalign.unwrap_ms(data["ardn_time_ms"])
+    width = int(bin_seconds * 1000)
+    n_bins = max(int((time_ms.max() - time_ms[0]) // width), 0)
+    bins = (time_ms - time_ms[0]) // width
+    counts = np.bincount(bins[(bins >= 0) & (bins < n_bins)], minlength=n_bins)
+    return counts / bin_seconds
+
+
+def bin_runs(raws, bin_seconds, pool=None):
+    """bin_run for every run, on the worker pool (in this process if pool is None). Results are in the order of raws."""
+    if pool is None:
+        return [bin_run(raw, bin_seconds) for raw in raws]
+    return list(pool.map(bin_run, raws, [bin_seconds] * len(raws)))
+
+
+def condition_rates(conditions, rates):
+    """Pool the per-bin rates of all runs with the same condition tag, keeping the order of first appearance."""
+    pooled = {}
+    for condition, run_rates in zip(conditions, rates):
+        pooled.setdefault(condition, []).append(run_rates)
+    return {condition: np.concatenate(runs) for condition, runs in pooled.items()}
+
+
+def condition_summary(conditions, rates):
+    """One row per condition: number of runs and bins, mean rate, spread and standard error of the mean.
+
+    The standard error is taken between runs when there are several, since bins of one run share
+    its systematics, and between bins otherwise.
+    """
+    rows = []
+    for condition in dict.fromkeys(conditions):
+        runs = [r for c, r in zip(conditions, rates) if c == condition and len(r)]
+        pooled = np.concatenate(runs) if runs else np.empty(0)
+        run_means = np.array([r.mean() for r in runs])
+        if len(runs) > 1:
+            sem = run_means.std(ddof=1) / np.sqrt(len(runs))
+        elif len(pooled) > 1:
+            sem = pooled.std(ddof=1) / np.sqrt(len(pooled))
+        else:
+            sem = np.nan
+        rows.append({
+            "condition": condition,
+            "runs": len(runs),
+            "bins": len(pooled),
+            "mean rate [Hz]": pooled.mean() if len(pooled) else np.nan,
+            "std [Hz]": pooled.std(ddof=1) if len(pooled) > 1 else np.nan,
+            "sem [Hz]": sem,
+        })
+    return pd.DataFrame(rows)
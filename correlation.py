@@ -0,0 +1,46 @@
+#Cross-correlation of the rates of several detectors, to see whether fluctuations in one lead or lag another
+#The series are binned on one grid of the common timebase (see clockalign.py) and correlated with FFTs,
+#O(n log n) instead of O(n^2)
+
+import numpy as np
+from scipy import fft
+
+
+def grid_counts(times_ms, bin_seconds):
+    """Event counts of every detector in bins of bin_seconds on one grid of the common timebase.
+
+    times_ms: int64 event times in ms of host time, one array per detector (see Pipeline.aligned_times);
+    they are not assumed to be in order, the Arduino clock goes back after a reset. The grid covers the span
+    in which all detectors were recording; returns the grid start in ms and an (n_detectors, n_bins) array.
+    """
+    width = int(round(bin_seconds * 1000))
+    start = max(t.min() for t in times_ms)
+    end = min(t.max() for t in times_ms)
+    n_bins = max(int((end - start) // width), 0)
+    grid = np.zeros((len(times_ms), n_bins))
+    for i, t in enumerate(times_ms):
+        inside = t[(t >= start) & (t < start + n_bins * width)]
+        grid[i] = np.bincount((inside - start) // width, minlength=n_bins)
+    return start, grid
+
+
+def cross_correlation(x, y, max_lag):
+    """Pearson correlation between x and y shifted by every lag from -max_lag to max_lag bins.
+
+    A peak at a positive lag k means y follows x by k bins. Both series are zero-padded to
+    len + max_lag only, which is enough to keep the circular FFT correlation from wrapping around.
+    Returns the lags and the correlations (NaN if a series is constant).
+    """
+    n = len(x)
+    max_lag = max(min(int(max_lag), n - 1), 0)
+    lags = np.arange(-max_lag, max_lag + 1)
+    x = x - x.mean()
+    y = y - y.mean()
+    norm = x.std() * y.std()
+    if n == 0 or norm == 0:
+        return lags, np.full(len(lags), np.nan)
+    size = fft.next_fast_len(n + max_lag, real=True)
+    products = fft.irfft(np.conj(fft.rfft(x, size)) * fft.rfft(y, size), size)
+    # products[k] = sum over t of x[t] * y[t + k], negative lags are at the end
+    sums = np.concatenate([products[size - max_lag:], products[:max_lag + 1]])
+    return lags, sums / (n - np.abs(lags)) / norm
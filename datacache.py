@@ -0,0 +1,133 @@
+#Bounded in-memory cache for parsed datasets, shared by every Streamlit session of the process
+#Entries are kept by reference (no pickling), so all users who upload the same file get the same array
+
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_key(buffer, prefix="run"):
+    """Key for a dataset: a hash of the raw uploaded bytes."""
+    return prefix + ":" + hashlib.blake2b(buffer, digest_size=16).hexdigest()
+
+
+def sizeof(value):
+    """Resident size of a cached value in bytes (numpy arrays report their buffer size, dicts the sum of their values)."""
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is not None:
+        return int(nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value.values())
+    return sys.getsizeof(value)
+
+
+class DatasetCache:
+    """LRU cache with a byte budget and an optional time-to-live.
+
+    max_bytes: total size of the cached values, least recently used entries are evicted first
+    ttl: seconds after which an entry is dropped even if there is room, None keeps entries forever
+    """
+
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.resident_bytes = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes, stored_at)
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> lock held while that key is being loaded
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.monotonic() - entry[2] > self.ttl:
+            self._drop(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _drop(self, key):
+        value, nbytes, stored_at = self._entries.pop(key)
+        self.resident_bytes -= nbytes
+
+    def _store(self, key, value):
+        nbytes = sizeof(value)
+        if nbytes > self.max_bytes:
+            # Larger than the whole budget: hand it back without caching it
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (value, nbytes, time.monotonic())
+        self.resident_bytes += nbytes
+        while self.resident_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def get(self, key, load):
+        """Return the cached value for key, calling load() once to create it on a miss.
+
+        Concurrent requests for the same key wait for the first load instead of parsing twice.
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._lookup(key)
+            if entry is not None:
+                return entry[0]
+            try:
+                value = load()
+                with self._lock:
+                    self._store(key, value)
+            finally:
+                # Also when load() raises (parse error, st.stop), so the key lock does not stay behind
+                with self._lock:
+                    self._loading.pop(key, None)
+            return value
+
+    def lookup(self, key):
+        """Return the cached value for key, or None on a miss (for callers that load many keys at once)."""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.resident_bytes = 0
+
+    def stats(self):
+        """Counters and sizes for the admin page."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,198 @@
+#Parsing of CosmicWatch run files into compact numpy arrays
+#Kept free of streamlit so it can also be used by the recorder and by worker processes
+
+import gzip
+import io
+
+import numpy as np
+import pandas as pd
+
+try:  # optional, only needed for .zst runs
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#Storage type of each parsed column. The host time written by the recorder is kept as int64
+#nanoseconds (naive local time, like datetime.now()). The Arduino prints the event count, the millis()
+#time stamp and the running deadtime as unsigned longs, the ADC value is 10 bits and the SiPM voltage
+#and temperature only carry two decimals, so 30 bytes per event is enough instead of 8 per column.
+DATA_DTYPE = np.dtype([
+    ("host_time_ns", np.int64),
+    ("event_number", np.uint32),
+    ("ardn_time_ms", np.uint32),
+    ("adc", np.uint16),
+    ("sipm", np.float32),
+    ("deadtime", np.uint32),
+    ("temperature", np.float32),
+])
+
+#Columns of a data line: Comp_date Comp_time Event Ardn_time[ms] ADC[0-1023] SiPM[mV] Deadtime[ms] Temp[C] Name
+#Recordings of several detectors add a coincidence group ID as last column (see coincidence.py), it is not read here
+DATA_COLUMNS = range(0, 8)
+NUMERIC_COLUMNS = range(2, 8)
+
+#Host time of lines whose date or time could not be decoded (same bit pattern as numpy's NaT)
+MISSING_TIME = np.iinfo(np.int64).min
+#Days of each month in a common year, February gets one more in leap years
+DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+#The header is never longer than this, see the 'Device ID' line written by main.py
+HEADER_SEARCH_LINES = 1000
+
+
+#Magic bytes at the start of compressed archives of runs
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class _Replay(io.RawIOBase):
+    """Binary stream that first returns already-read bytes and then continues with the rest of stream."""
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.head:
+            n = min(len(buffer), len(self.head))
+            buffer[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_run(stream):
+    """Binary stream of the text of a run, decompressing gzip and zstd archives on the fly.
+
+    The format is recognised by its magic bytes, so any file name works. The returned stream
+    decompresses as it is read and is not seekable for compressed runs. It never closes stream,
+    which stays owned by the caller.
+    """
+    magic = stream.read(4)
+    stream.seek(0)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=stream, mode="rb")  # does not close a fileobj it was given
+    if magic == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ValueError("This run is zstd-compressed; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True, closefd=False)
+    return _Borrowed(stream)
+
+
+class _Borrowed(io.RawIOBase):
+    """Raw view of a caller's binary stream. Closing the view (also when a BufferedReader around it
+    is collected) leaves the stream open, so an upload can be read again on the next rerun."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.stream.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.stream.seek(offset, whence)
+
+    def tell(self):
+        return self.stream.tell()
+
+    def readinto(self, buffer):
+        if hasattr(self.stream, "readinto"):
+            return self.stream.readinto(buffer)
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def count_header_lines(lines):
+    """Return the number of lines before the data, i.e. up to and including the last 'Device' line."""
+    header_lines = 0
+    for i, line in enumerate(lines[:HEADER_SEARCH_LINES]):
+        if b'Device' in line:
+            header_lines = i + 1
+    return header_lines
+
+
+def parse_run(stream):
+    """Parse a run file opened in binary mode (plain, gzip or zstd) into a structured array of DATA_DTYPE."""
+    # Step 1: find the header in the first lines only, then hand those lines back to the parser
+    # ahead of the rest, since a decompressing stream cannot be rewound
+    stream = io.BufferedReader(open_run(stream), buffer_size=1 << 20)
+    head = [stream.readline() for _ in range(HEADER_SEARCH_LINES)]
+    header_lines = count_header_lines(head)
+    stream = io.BufferedReader(_Replay(b"".join(head), stream), buffer_size=1 << 20)
+
+    # Step 2: parse the host date and time and the six numeric columns. Lines with the wrong number of
+    # fields are skipped, like genfromtxt(invalid_raise=False) did, and unparsable values become NaN
+    frame = pd.read_csv(stream, sep=" ", header=None, usecols=DATA_COLUMNS, skiprows=header_lines,
+                        dtype={0: str, 1: str}, on_bad_lines="skip", encoding="utf-8", encoding_errors="replace")
+    for col in NUMERIC_COLUMNS:
+        if frame[col].dtype == object:
+            frame[col] = pd.to_numeric(frame[col], errors="coerce")
+    frame = frame.dropna()
+
+    # Step 3: pack into the compact representation
+    # Remove first row of data because first flash is usually due to Arduino connecting to power, not cosmic ray
+    frame = frame.iloc[1:]
+    data = np.empty(len(frame), dtype=DATA_DTYPE)
+    data["host_time_ns"] = parse_host_time(frame[0].to_numpy(), frame[1].to_numpy())
+    for name, col in zip(DATA_DTYPE.names[1:], NUMERIC_COLUMNS):
+        data[name] = frame[col].to_numpy()
+    return data
+
+
+def _digits(strings, width):
+    """Character codes of fixed-width strings as an (n, width) array of digit values, -1 for non-digits."""
+    codes = strings.astype(f"U{width}").view(np.uint32).reshape(-1, width).astype(np.int64) - ord("0")
+    codes[(codes < 0) | (codes > 9)] = -1
+    return codes
+
+
+def parse_host_time(dates, times):
+    """Decode 'YYYY-MM-DD' and 'HH:MM:SS.ffffff' strings into int64 nanoseconds since 1970-01-01.
+
+    Works on the character codes of the whole column at once instead of calling datetime per row.
+    str(datetime) drops the fraction when it is exactly zero, which reads as zero here as well.
+    Lines that do not decode get MISSING_TIME.
+    """
+    if len(dates) == 0:
+        return np.empty(0, dtype=np.int64)
+    d = _digits(dates, 10)
+    t = _digits(times, 15)
+    year = d[:, 0] * 1000 + d[:, 1] * 100 + d[:, 2] * 10 + d[:, 3]
+    month = d[:, 5] * 10 + d[:, 6]
+    day = d[:, 8] * 10 + d[:, 9]
+    hour = t[:, 0] * 10 + t[:, 1]
+    minute = t[:, 3] * 10 + t[:, 4]
+    second = t[:, 6] * 10 + t[:, 7]
+    frac = t[:, 9:15]
+    micros = (np.maximum(frac, 0) * 10 ** np.arange(5, -1, -1)).sum(axis=1)
+
+    # Days since 1970-01-01 of a proleptic Gregorian date (H. Hinnant's days_from_civil)
+    y = year - (month <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    days = era * 146097 + doe - 719468
+
+    ns = ((days * 86400 + hour * 3600 + minute * 60 + second) * 1000000 + micros) * 1000
+    # A day past the end of its month (2026-02-30) would otherwise roll over into the next month
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_days = DAYS_IN_MONTH[np.clip(month, 1, 12) - 1] + ((month == 2) & leap)
+    valid = ((d[:, [0, 1, 2, 3, 5, 6, 8, 9]] >= 0).all(axis=1) & (t[:, [0, 1, 3, 4, 6, 7]] >= 0).all(axis=1)
+             & (month >= 1) & (month <= 12) & (day >= 1) & (day <= month_days)
+             & (hour < 24) & (minute < 60) & (second < 61))
+    return np.where(valid, ns, MISSING_TIME)
+
+
+def as_float(data, column):
+    """Float64 copy of one column, made only where a plot or fit needs it."""
+    return data[column].astype(np.float64)
@@ -0,0 +1,44 @@
+#Per-detector analysis (parse, then the pipeline.PRECOMPUTED stages) in worker processes that stay up between reruns
+#Results come back pickled by the executor: numpy arrays pickle as one copy of their buffer (protocol 5), and
+#the parent keeps them in the dataset cache anyway, so a shared memory round trip would only add a copy
+
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import dataparser
+import pipeline
+import timeindex
+
+
+def make_pool(max_workers=None):
+    """Process pool for analyze_run, or None when there is only one core to run it on."""
+    workers = max_workers or os.cpu_count() or 1
+    if workers <= 1:
+        return None
+    # spawn rather than fork: the Streamlit server is multi-threaded
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def analyze_run(raw, correct_deadtime=True, time_range=None):
+    """Worker side: parse one run from its raw bytes and compute pipeline.PRECOMPUTED for it.
+
+    raw can also be a slice of a run (see timeindex.byte_range), with time_range = (axis, start, end)
+    to trim it to the window. The outputs are keyed by pipeline.stage_key and the parsed events are returned as "data".
+    """
+    data = dataparser.parse_run(io.BytesIO(raw))
+    if time_range is not None:
+        data = timeindex.trim(data, *time_range)
+    arrays = pipeline.DetectorPipeline(data, correct_deadtime).export(pipeline.PRECOMPUTED)
+    arrays["data"] = data
+    return arrays
+
+
+def analyze_runs(pool, raws, correct_deadtime=True, time_ranges=None):
+    """analyze_run for every run on the pool (in this process if pool is None). Results are in the order of raws."""
+    time_ranges = time_ranges or [None] * len(raws)
+    if pool is None:
+        return [analyze_run(raw, correct_deadtime, time_range) for raw, time_range in zip(raws, time_ranges)]
+    futures = [pool.submit(analyze_run, raw, correct_deadtime, time_range) for raw, time_range in zip(raws, time_ranges)]
+    return [future.result() for future in futures]
@@ -0,0 +1,45 @@
+#Serialized Plotly figures, kept between reruns so large traces are not rebuilt and re-encoded every time
+#A cached spec holds the data part of a figure; colours, names and titles are patched onto it per session
+
+import json
+
+import plotly.io as pio
+
+
+class FigureSpec:
+    """JSON-compatible spec of a figure (numpy arrays are base64 strings) and its serialized size."""
+
+    def __init__(self, fig):
+        text = pio.to_json(fig, validate=False)
+        self.nbytes = len(text)
+        self.spec = json.loads(text)
+
+
+def figure_key(name, dataset_keys, *params):
+    """Cache key of a chart: its name, the datasets it shows and the analysis parameters it depends on."""
+    return "fig:" + name + ":" + ",".join(dataset_keys) + ":" + repr(params)
+
+
+def _merge(base, patch):
+    """Copy of base with patch merged in; only the dicts along patched paths are copied."""
+    merged = dict(base)
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def apply_style(spec, layout=None, traces=None):
+    """Spec with style-only changes (colours, trace names, titles) applied, leaving the cached spec untouched.
+
+    traces is a list of patches in trace order, e.g. [{"name": "Fridge", "marker": {"color": "#1f77b4"}}].
+    """
+    styled = dict(spec)
+    if layout:
+        styled["layout"] = _merge(spec.get("layout", {}), layout)
+    if traces:
+        styled["data"] = [_merge(trace, patch) if patch else trace
+                          for trace, patch in zip(spec["data"], traces)] + spec["data"][len(traces):]
+    return styled
@@ -21,623 +21,804 @@ import plotly.figure_factory as ff
 import plotly.graph_objects as go
 import plotly.express as px
 import io 
+import os
+from datetime import timedelta
 import statsmodels.api as sm
-
-#st.cache_data means that once you choose your file, it will be saved until you close/refresh the tab or pick a different file
-@st.cache_data
-def getdata(datafile):
-    file = io.StringIO(datafile.getvalue().decode("utf-8"))
-    lines = file.readlines()
-    
-    header_lines = 0
-    column_array = range(2,8) 
-    for i in range(min(len(lines), 1000)):
-        if 'Device' in lines[i]:
-            header_lines = i + 1
-
-    file.seek(0)  # rewind the file so genfromtxt works
-    data = np.genfromtxt(file, dtype=str, delimiter=' ', usecols=column_array,
-                        invalid_raise=False, skip_header=header_lines)
-
-    # If only one row is loaded, make it 2D
-    if data.ndim == 1:
-        data = data.reshape(1, -1)
-    # Remove first row of data because first flash is usually due to Arduino connecting to power, not cosmic ray
-    data = data[1:] 
-
-    # Set variable arrays
-    event_number = data[:,0].astype(float)
-    Ardn_time_ms = data[:,1].astype(float)
-    adc = data[:,2].astype(float)
-    sipm = data[:,3].astype(float)
-    deadtime = data[:,4].astype(float)
-    temperature = data[:,5].astype(float) 
-
-    # Output of function
-    return event_number, Ardn_time_ms, adc, sipm, deadtime, temperature
-
-
-#code for data analysis page when using one detector 
-
-
-def one_home():
-    st.subheader("Mode: One Detector")
-    thedata = st.file_uploader(label="Upload data file", accept_multiple_files=False) 
-
-    if thedata is not None: 
-        # Get data arrays
-        event_number, Ardn_time_ms, adc, sipm, deadtime, temperature = getdata(thedata) 
-        # Convert Arduino time from ms to minutes 
-        ardn_time_min = Ardn_time_ms / 60000.0 
-        data = {
-            "event number": event_number,
-            "ardn time": ardn_time_min,
-            "adc": adc,
-            "sipm": sipm,
-            "deadtime": deadtime,
-            "temp": temperature
-        }
-
-        # Let the user pick legends for detectors 
-        line_color = st.color_picker("Pick a line color for SiPM voltage plot", "#1f77b4")
-
-        #Number of events per time histogram
-
-        # Step 1: Set bin size (1 minute)
-        bin_size = 1.0  # minutes
-        time = ardn_time_min
-
-        # Step 2: Create DataFrame with just time
-        df_time = pd.DataFrame({"time": time})
-
-        # Step 3: Plot histogram
-        fig2 = px.histogram(
-            df_time,
-            x="time",
-            nbins=int((time[-1] - time[0]) / bin_size),
-            title="Event Count per Minute",
-        )
-
-        fig2.update_traces(
-            marker_color=line_color,
-            marker_line_width=1,
-            marker_line_color="black",
-            opacity=0.8,
-            hovertemplate=
-                "Time: %{x} min<br>" +
-                "Events: %{y}<br>" +
-                "<extra></extra>"
-        )
-
-        fig2.update_layout(
-            xaxis=dict(
-                title="Time [minutes]",
-            ),
-            yaxis=dict(
-                title="Number of Events",
-            ),
-            bargap=0.05,
-            width=800,
-            height=500
-        )
-
-        st.plotly_chart(fig2, use_container_width=True) 
-        
-        #Rate vs. Calculated SiPM Peak Voltage Histogram 
-
-        # Step 1: Set up values and bin parameters
-        bin_size = 0.25  # 15 second intervals 
-        time = ardn_time_min  
-        sipm_values = sipm
-
-        rate = []
-        peakV = []
-
-        curr_time = time[0]
-        start_index = 0
-        peak = 0
-
-        # Step 2: Loop through data to collect per-bin peak voltage and rate
-        for i in range(1, len(time)):
-            if time[i] - curr_time >= bin_size:
-                peak = max(sipm_values[peak:(i+1)])
-                duration = time[i] - curr_time
-                r = (i - start_index) / (duration * 60)  # Convert from per minute to per second (Hz)
-                rate.append(r)
-                peakV.append(peak)
-                curr_time = time[i]
-                start_index = i
-                peak = i
-
-        # Step 3: Create histogram from peakV, weighted by rate
-        df_hist = pd.DataFrame({
-            "peak": peakV,
-            "rate": rate
-        })
-
-        fig = px.histogram(
-            df_hist,
-            x="peak",
-            y="rate",
-            title="SiPM Peak Voltages vs. Detection Rate",
-        )
-
-        fig.update_traces(
-            marker_color=line_color,
-            marker_line_width=1,
-            marker_line_color="black",
-            opacity=0.7,
-            hovertemplate=
-                "Peak Voltage: %{x} mV<br>" +
-                "Rate: %{y:.4f} s⁻¹<br>" +
-                "<extra></extra>"
-        )
-
-        fig.update_layout(
-            xaxis=dict(
-                title="Calculated SiPM peak voltage [mV]",
-                #type="log"
-            ),
-            yaxis=dict(
-                title="Rate/bin [s⁻¹]",
-                #type="log"
-            ),
-            bargap=0.05,
-            width=800,
-            height=500
-        )
-
+from concurrent.futures.process import BrokenProcessPool
+
+import catalog
+import clockalign
+import comparison
+import correlation
+import datacache
+import dataparser
+import detectorpool
+import figcache
+import perf
+import pipeline
+import rates
+import selection
+import summarystats
+import timeindex
+import timeofday
+
+#One dataset cache for the whole server process, shared by all sessions (st.cache_resource does not copy or pickle)
+#Size budget in MB and time-to-live in seconds can be set with CHARM_CACHE_MB and CHARM_CACHE_TTL
+@st.cache_resource
+def dataset_cache():
+    ttl = os.environ.get("CHARM_CACHE_TTL")
+    return datacache.DatasetCache(max_bytes=int(os.environ.get("CHARM_CACHE_MB", "512")) * 2**20,
+                                  ttl=float(ttl) if ttl else None)
+
+
+#Worker processes for the per-detector analysis, started once and shared by every session (count: CHARM_WORKERS)
+@st.cache_resource
+def detector_pool():
+    workers = os.environ.get("CHARM_WORKERS")
+    return detectorpool.make_pool(int(workers) if workers else None)
+
+
+#Serialized figures of the charts with event-level traces, shared like the datasets (size in MB: CHARM_FIGURE_CACHE_MB)
+@st.cache_resource
+def figure_cache():
+    return datacache.DatasetCache(max_bytes=int(os.environ.get("CHARM_FIGURE_CACHE_MB", "256")) * 2**20)
+
+
+def upload_key(datafile):
+    return datacache.content_key(datafile.getbuffer())
+
+
+#Once you choose your file, it will be kept in the dataset cache until it is evicted, so the same upload is only parsed once
+#getdata returns one structured array (see dataparser.DATA_DTYPE), columns are accessed by name, e.g. data["sipm"]
+#Runs can also be uploaded gzip- or zstd-compressed, they are decompressed while parsing
+#With a time_range = (axis, start, end) only that window of the run is parsed (see time_range_selector)
+def getdata(datafile, key=None, time_range=None):
+    key = key or upload_key(datafile)
+    def load():
+        with perf.stage("parse", bytes_in=datafile.size) as record:
+            try:
+                if time_range is None:
+                    datafile.seek(0)  # the upload is a BytesIO already, parse it in place instead of copying it
+                    data = dataparser.parse_run(datafile)
+                else:
+                    raw = upload_bytes(datafile, key, time_range)
+                    record["bytes_in"] = len(raw)
+                    data = timeindex.trim(dataparser.parse_run(io.BytesIO(raw)), *time_range)
+            except ValueError as error:
+                st.error(f"{datafile.name}: {error}")
+                st.stop()
+            record.update(events=len(data), bytes_out=data.nbytes)
+        data.flags.writeable = False  # the same array is handed to every session
+        return data
+    return dataset_cache().get(range_key(key, time_range), load)
+
+
+#Time index of an upload (see timeindex.py), built on first load and kept in the dataset cache; None for compressed uploads
+def upload_index(datafile, key):
+    if not timeindex.is_plain(datafile.getbuffer()):
+        return None
+    def load():
+        with perf.stage("time index", bytes_in=datafile.size):
+            return timeindex.build_index(datafile.getbuffer())
+    return dataset_cache().get("index:" + key, load)
+
+
+#Raw bytes of an upload, or only the slice of it that can hold the events of time_range
+def upload_bytes(datafile, key, time_range=None):
+    if time_range is None:
+        return datafile.getvalue()
+    lo, hi = timeindex.byte_range(upload_index(datafile, key), datafile.size, *time_range)
+    return datafile.getbuffer()[lo:hi].tobytes()
+
+
+def range_key(key, time_range=None):
+    return key if time_range is None else f"{key}:{time_range[0]}:{time_range[1]}-{time_range[2]}"
+
+
+#Pipeline of the detector page (see pipeline.py), with its pipeline.PRECOMPUTED outputs taken from the dataset cache
+#Runs that are not in the dataset cache yet are parsed and analysed on the worker pool at the same time
+#With time_ranges (one per file, see time_range_selector) only those windows of the runs are parsed
+def detector_pipeline(files, keys, correct_deadtime, time_ranges=None):
+    cache = dataset_cache()
+    time_ranges = time_ranges or [None] * len(files)
+    data_keys = [range_key(key, time_range) for key, time_range in zip(keys, time_ranges)]
+    result_keys = [f"detector:{key}:{correct_deadtime}" for key in data_keys]
+    datasets = [cache.lookup(key) for key in data_keys]
+    results = [cache.lookup(result_key) for result_key in result_keys]
+    missing = [i for i in range(len(files)) if datasets[i] is None and results[i] is None]
+    if missing:
+        raws = [upload_bytes(files[i], keys[i], time_ranges[i]) for i in missing]
+        missing_ranges = [time_ranges[i] for i in missing]
+        with perf.stage("parse + analysis (workers)", runs=len(missing), bytes_in=sum(len(raw) for raw in raws)):
+            try:
+                fresh = detectorpool.analyze_runs(detector_pool(), raws, correct_deadtime, missing_ranges)
+            except BrokenProcessPool:
+                detector_pool.clear()  # a worker died, start a new pool on the next run and analyse here for now
+                fresh = detectorpool.analyze_runs(None, raws, correct_deadtime, missing_ranges)
+            except ValueError as error:
+                st.error(str(error))
+                st.stop()
+        for i, arrays in zip(missing, fresh):
+            datasets[i] = arrays.pop("data")
+            datasets[i].flags.writeable = False
+            cache.put(data_keys[i], datasets[i])
+            results[i] = arrays
+            cache.put(result_keys[i], arrays)
+    detectors = []
+    for i in range(len(files)):
+        if datasets[i] is None:
+            datasets[i] = getdata(files[i], keys[i], time_ranges[i])
+        det = pipeline.DetectorPipeline(datasets[i], correct_deadtime, results[i], name=i)
+        if results[i] is None:
+            cache.put(result_keys[i], det.export(pipeline.PRECOMPUTED))
+        detectors.append(det)
+    return pipeline.Pipeline(detectors)
+
+
+#Pipeline of runs from the server's run catalog (see catalog.py): their events are memory-mapped, not uploaded
+#With time_ranges only those windows are loaded, through the runs' time index (see catalog.load_range)
+def catalog_pipeline(rows, correct_deadtime, time_ranges=None):
+    cache = dataset_cache()
+    time_ranges = time_ranges or [None] * len(rows)
+    detectors = []
+    for i, (row, time_range) in enumerate(zip(rows, time_ranges)):
+        data_key = range_key(catalog.run_key(row), time_range)
+        result_key = f"detector:{data_key}:{correct_deadtime}"
+        results = cache.lookup(result_key)
+        if time_range is None:
+            with perf.stage("open (memory map)", run=row["path"]):
+                data = catalog.load(row)
+        else:
+            data = cache.get(data_key, lambda: catalog_range(row, time_range))
+        det = pipeline.DetectorPipeline(data, correct_deadtime, results, name=i)
+        if results is None:
+            cache.put(result_key, det.export(pipeline.PRECOMPUTED))
+        detectors.append(det)
+    return pipeline.Pipeline(detectors)
+
+
+def catalog_range(row, time_range):
+    with perf.stage("parse (time range)", run=row["path"]) as record:
+        data = catalog.load_range(row, *time_range)
+        record.update(events=len(data), bytes_out=data.nbytes)
+    data.flags.writeable = False
+    return data
+
+
+#Time index of a catalogued run, kept in the dataset cache like those of uploads
+def catalog_index(row):
+    return dataset_cache().get("index:" + catalog.run_key(row), lambda: catalog.load_index(row))
+
+
+#Pipeline of the events of every run that pass the cuts (see selection.py)
+#The subsets and their chart inputs are cached like whole runs, under the run key plus the cuts
+def selected_pipeline(pipe, keys, cuts, correct_deadtime):
+    cache = dataset_cache()
+    detectors = []
+    selected_keys = [f"{key}|{selection.cuts_key(cuts)}" for key in keys]
+    for i, (data, key, selected_key) in enumerate(zip(pipe.datasets, keys, selected_keys)):
+        def load():
+            indexes = {column: sorted_index(data, key, column) for column, low, high in cuts
+                       if column in selection.INDEXED_COLUMNS}
+            with perf.stage("selection", events=len(data)) as record:
+                subset = data[selection.select(data, cuts, indexes)]
+                record.update(selected=len(subset), bytes_out=subset.nbytes)
+            subset.flags.writeable = False
+            return subset
+        subset = cache.get(selected_key, load)
+        result_key = f"detector:{selected_key}:{correct_deadtime}"
+        results = cache.lookup(result_key)
+        det = pipeline.DetectorPipeline(subset, correct_deadtime, results, name=i)
+        if results is None:
+            cache.put(result_key, det.export(pipeline.PRECOMPUTED))
+        detectors.append(det)
+    return pipeline.Pipeline(detectors), selected_keys
+
+
+#Sorted index of one column of a run, built on the first cut on that column and kept in the dataset cache
+def sorted_index(data, key, column):
+    def load():
+        with perf.stage("sorted index", column=column, events=len(data)):
+            return selection.SortedIndex(data[column])
+    return dataset_cache().get(f"sorted:{key}:{column}", load)
+
+
+#Show a chart whose figure is built once per key (datasets + parameters) and then served from the figure cache.
+#build() should only set up the data and fixed layout; colours and labels go in the style patches (see figcache.apply_style)
+def cached_chart(key, build, layout=None, traces=None):
+    def load():
+        with perf.stage("figure build", chart=key.split(":")[1]) as record:
+            spec = figcache.FigureSpec(build())
+            record["bytes_out"] = spec.nbytes
+        return spec
+    spec = figure_cache().get(key, load)
+    with perf.stage("chart transfer", chart=key.split(":")[1], bytes_out=spec.nbytes):
+        st.plotly_chart(figcache.apply_style(spec.spec, layout, traces), use_container_width=True)
+
+
+#st.plotly_chart, timed as one stage when performance instrumentation is on
+def show_chart(fig):
+    with perf.stage("chart transfer", chart=fig.layout.title.text):
         st.plotly_chart(fig, use_container_width=True)
 
-        # Dark count rate (noise) against temperature 
-        dark_threshold = float(st.text_input("Enter threshold (in mV) for dark counts: ", value="90")) #mV
-
-        # Step 1: Filter for "dark counts" — events with peak SiPM voltage < threshold (e.g., 200 mV)
-        bin_size = 1
-        dark_rates = []
-        dark_temps = []
-        curr_time = ardn_time_min[0]
-        start_index = 0
-        peak = 0
-
-        for i in range(1, len(ardn_time_min)):
-            if ardn_time_min[i] - curr_time >= bin_size:
-                peak = max(sipm[start_index:i+1])
-                avg_temp = np.mean(data["temp"][start_index:i+1])
-                duration = ardn_time_min[i] - curr_time
-                r = (i - start_index) / (duration * 60)  # Hz
-
-                # If the peak SiPM voltage is low, treat as dark count
-                if peak < dark_threshold:
-                    dark_rates.append(r)
-                    dark_temps.append(avg_temp)
-
-                curr_time = ardn_time_min[i]
-                start_index = i
-
-        # Step 2: Make DataFrame
-        df_dark = pd.DataFrame({
-            "temperature": dark_temps,
-            "dark_rate": dark_rates
-        })
-
-        # Step 3: Scatter + trend line
-        # Step 1: Apply LOWESS smoothing
-        lowess_result = sm.nonparametric.lowess(
-            endog=df_dark["dark_rate"],
-            exog=df_dark["temperature"],
-            frac=0.3  # Smoothing parameter (adjust as needed)
-        )
-
-        # Step 2: Create scatter plot
-        fig = px.scatter(
-            df_dark,
-            x="temperature",
-            y="dark_rate",
-            title="Dark Count Rate vs Temperature",
-            labels={"temperature": "Temperature [°C]", "dark_rate": "Dark Rate [Hz]"},
-        )
-
-        # Step 3: Add smoothed line manually
-        fig.add_trace(go.Scatter(
-            x=lowess_result[:, 0],
-            y=lowess_result[:, 1],
-            mode="lines",
-            name="Trend",
-            line=dict(color="red", width=2, dash="solid")
-        ))
 
-        # Step 4: Update layout
-        fig.update_layout(
-            width=800,
-            height=500
-        )
-
-        st.plotly_chart(fig, use_container_width=True)
-
-        # Sipm Voltages vs. Time graph 
-
-        # Line of best fit using 1st-degree polynomial 
-        coeffs = np.polyfit(ardn_time_min, sipm, deg=1)
-        poly = np.poly1d(coeffs)
-        trend_y = poly(ardn_time_min)
-
-        # Create plot
-        fig = go.Figure()
-
-        # Add main SiPM voltage line first (so trend appears above)
-        fig.add_trace(go.Scatter(
-            x=ardn_time_min,
-            y=sipm,
-            mode="lines",
-            name="SiPM Voltage",
-            line=dict(color=line_color),
-            hovertemplate="Time elapsed = %{x:.2f} min<br>SiPM voltage = %{y:.2f} mV<extra></extra>"
+#Summary statistics panel: means, variances, quantiles and the ADC mode of every run,
+#computed in one pass with mergeable sketches (see summarystats.py)
+def stats_panel(datasets, labels):
+    with st.expander("Summary statistics"):
+        with perf.stage("summary statistics", events=sum(len(data) for data in datasets)):
+            summaries = [summarystats.summarize(data) for data in datasets]
+        if len(summaries) > 1:
+            combined = summarystats.RunSummary()
+            for summary in summaries:
+                combined.merge(summary)
+            summaries = summaries + [combined]
+            labels = list(labels) + ["All detectors"]
+
+        for label, summary in zip(labels, summaries):
+            st.markdown(f"**{label}** (mode of the ADC histogram: {summary.adc_mode})")
+            st.dataframe(pd.DataFrame.from_dict(summary.table(), orient="index"))
+
+        # Small runs can afford the exact statistics; show them next to the sketch as a check
+        if sum(len(data) for data in datasets) <= summarystats.EXACT_LIMIT:
+            if st.checkbox("Show exact statistics"):
+                for label, data, summary in zip(labels, datasets, summaries):
+                    exact = pd.DataFrame.from_dict(summarystats.exact_table(data), orient="index")
+                    sketch = pd.DataFrame.from_dict(summary.table(), orient="index")
+                    quantile_cols = [col for col in exact.columns if col.startswith("p")]
+                    rel_error = ((sketch[quantile_cols] - exact[quantile_cols]).abs()
+                                 / exact[quantile_cols].abs().where(exact[quantile_cols] != 0)).max().max()
+                    st.markdown(f"**{label}** exact (largest relative quantile error of the sketch: {rel_error:.2%})")
+                    st.dataframe(exact)
+
+
+#Signals by time of day, from the sorted host timestamps written by the recorder (see timeofday.py)
+def time_of_day_charts(hosts, labels, colors):
+    bin_minutes = st.select_slider("Time of day bin width [minutes]", options=[5, 10, 15, 30, 60, 120], value=60)
+    calendar_bin = st.radio("Calendar bins", ["Hour", "Day"], horizontal=True)
+
+    fig_tod = go.Figure()
+    fig_cal = go.Figure()
+    for host, label, color in zip(hosts, labels, colors):
+        if len(host) < 2:
+            continue
+        with perf.stage("time of day", events=len(host)):
+            hours, counts, exposure, rate = timeofday.time_of_day_rate(host, bin_minutes)
+            starts, cal_counts, cal_exposure, cal_rate = timeofday.calendar_rate(host, 60 if calendar_bin == "Hour" else 24 * 60)
+        fig_tod.add_trace(go.Bar(
+            x=hours,
+            y=rate,
+            customdata=np.stack([counts, exposure / 3600], axis=-1),
+            name=label,
+            marker_color=color,
+            opacity=0.7,
+            hovertemplate="Hour of day: %{x:.2f}<br>Rate: %{y:.4f} s⁻¹<br>Events: %{customdata[0]}<br>Observed: %{customdata[1]:.1f} h<extra></extra>"
         ))
-
-        # Add polynomial trend line
-        fig.add_trace(go.Scatter(
-            x=ardn_time_min,
-            y=trend_y,
-            mode="lines",
-            name="Best Fit Trend",
-            line=dict(color="orange", width=3, dash="dot"),
-            hovertemplate="Trend (best fit) = %{y:.2f} mV<extra></extra>"
+        fig_cal.add_trace(go.Scatter(
+            x=starts,
+            y=cal_rate,
+            mode="lines+markers",
+            name=label,
+            line=dict(color=color)
         ))
 
-        # Final layout
-        fig.update_layout(
-            title="SiPM Voltage Over Time",
-            xaxis_title="Time Elapsed (min)",
-            yaxis_title="SiPM Voltage (mV)",
-            width=700,
-            height=500
-        )
-
-        # Display SiPM Voltage vs Time graph
-        st.plotly_chart(fig, use_container_width=True) 
-
-
-#code for data analysis page when using two detectors 
-
-
-def two_home():
-    st.subheader("Mode: Two Detectors")
-    thedata = st.file_uploader(label="Upload data file(s)", accept_multiple_files=True)
-    if thedata and len(thedata) == 2:
-        parsed_data = {}
-        for i, file in enumerate(thedata):
-            event_number, Ardn_time_ms, adc, sipm, deadtime, temperature = getdata(file)
-            ardn_time_min = Ardn_time_ms / 60000.0
-            parsed_data[i] = {
-                "event_number": event_number,
-                "ardn_time_min": ardn_time_min,
-                "adc": adc,
-                "sipm": sipm,
-                "deadtime": deadtime,
-                "temperature": temperature
-            }
-
-        # Coincidence checkbox
-        is_coincidence = st.checkbox("Were the detectors in coincidence mode?")
-
-        # Labels and colors for detectors
-        label0 = st.text_input("Label for Detector 1", value="Detector 1")
-        color0 = st.color_picker("Color for Detector 1", value="#1f77b4")
-        label1 = st.text_input("Label for Detector 2", value="Detector 2")
-        color1 = st.color_picker("Color for Detector 2", value="#ff7f0e")
-
-        if not is_coincidence:
-            st.write("Upcoming feature: choose experiment type")
-            experiment_type = st.radio("Choose experiment type:", ["Temperature", "Altitude", "Shielding"])
-        
-        # ---- Graph: Number of Events Per Minute ----
-        fig_time = go.Figure()
-        for i, (label, color) in enumerate([(label0, color0), (label1, color1)]):
-            time = parsed_data[i]["ardn_time_min"]
-            fig_time.add_trace(go.Histogram(
-                x=time,
+    fig_tod.update_layout(title="Detection Rate by Time of Day",
+                          xaxis_title="Time of day [hours]",
+                          yaxis_title="Rate [s⁻¹]",
+                          barmode="overlay",
+                          width=800,
+                          height=500)
+    show_chart(fig_tod)
+
+    fig_cal.update_layout(title=f"Detection Rate per {calendar_bin}",
+                          xaxis_title="Date",
+                          yaxis_title="Rate [s⁻¹]",
+                          width=800,
+                          height=500)
+    show_chart(fig_cal)
+
+
+#Common timebase of the detectors: their Arduino clocks aligned to the host clock (see clockalign.py)
+#Returns the event times of every detector in ms of host time; refined times are kept in the dataset cache
+#under the run keys and the refine window, the clock fits are cached with the other pipeline.PRECOMPUTED outputs
+def clock_alignment(pipe, keys, labels, colors):
+    refine = st.checkbox("Refine the clock alignment with coincident events")
+    fig = go.Figure()
+    for label, color, knots in zip(labels, colors, pipe.each("clock_fit")):
+        if knots.shape[1]:
+            fig.add_trace(go.Scatter(
+                x=pd.to_datetime(knots[0] + knots[1], unit="ms"),
+                y=(knots[1] - knots[1][0]) / 1000,
+                mode="lines+markers",
                 name=label,
-                marker_color=color,
-                opacity=0.7,
-                xbins=dict(size=1.0)
+                line=dict(color=color)
             ))
-        fig_time.update_layout(title="Event Count per Minute",
-                               xaxis_title="Time [minutes]",
-                               yaxis_title="Number of Events",
-                               barmode="overlay",
-                               width=800,
-                               height=500)
-        st.plotly_chart(fig_time, use_container_width=True)
-
-        # ---- Graph: SiPM Peak Voltages vs Detection Rate ----
-        fig_peak = go.Figure()
-        for i, (label, color) in enumerate([(label0, color0), (label1, color1)]):
-            time = parsed_data[i]["ardn_time_min"]
-            sipm = parsed_data[i]["sipm"]
-            rate, peakV = [], []
-            bin_size = 0.25
-            curr_time = time[0]
-            start_index = 0
-            peak = 0
-            for j in range(1, len(time)):
-                if time[j] - curr_time >= bin_size:
-                    peak = max(sipm[peak:(j+1)])
-                    duration = time[j] - curr_time
-                    r = (j - start_index) / (duration * 60)
-                    rate.append(r)
-                    peakV.append(peak)
-                    curr_time = time[j]
-                    start_index = j
-                    peak = j
-            fig_peak.add_trace(go.Histogram(
-                x=peakV,
-                y=rate,
-                name=label,
-                marker_color=color,
-                histfunc="sum",
-                opacity=0.7,
-                xbins=dict(size=10)
+    fig.update_layout(title="Arduino Clock Drift against the Host Clock",
+                      xaxis_title="Host time",
+                      yaxis_title="Drift since the start [s]",
+                      width=800,
+                      height=400)
+    show_chart(fig)
+    if not refine:
+        return pipe.aligned_times()
+    window = clockalign.REFINE_WINDOW_MS
+    return dataset_cache().get(f"aligned:{','.join(keys)}:{window}", lambda: pipe.aligned_times(window))
+
+
+#Cross-correlation of the rate of every detector with a reference detector, on the common timebase (see correlation.py)
+def cross_correlation_chart(times, labels, colors):
+    col1, col2, col3 = st.columns(3)
+    bin_seconds = col1.select_slider("Correlation bin width [s]", options=[1, 5, 10, 30, 60], value=10)
+    max_lag_s = col2.number_input("Largest lag [s]", min_value=bin_seconds, value=600, step=bin_seconds)
+    reference = col3.selectbox("Reference detector", range(len(labels)), format_func=lambda i: labels[i])
+
+    with perf.stage("cross-correlation", bin_seconds=bin_seconds, max_lag_s=max_lag_s):
+        start, grid = correlation.grid_counts(times, bin_seconds)
+        if grid.shape[1] < 2:
+            st.write("The runs do not overlap in time, there is nothing to correlate.")
+            return
+        fig = go.Figure()
+        for i in range(len(labels)):
+            if i == reference:
+                continue
+            lags, corr = correlation.cross_correlation(grid[reference], grid[i], max_lag_s // bin_seconds)
+            fig.add_trace(go.Scatter(
+                x=lags * bin_seconds,
+                y=corr,
+                mode="lines",
+                name=labels[i],
+                line=dict(color=colors[i])
             ))
-        fig_peak.update_layout(title="SiPM Peak Voltages vs Detection Rate",
-                               xaxis_title="Calculated SiPM peak voltage [mV]",
-                               yaxis_title="Rate/bin [s⁻¹]",
-                               barmode="overlay",
-                               width=800,
-                               height=500)
-        st.plotly_chart(fig_peak, use_container_width=True)
-
-        # ---- Graph: Dark Count Rate vs Temperature ----
-        fig_dark = go.Figure()
-        threshold0 = float(st.text_input(f"Threshold (mV) for dark counts ({label0}):", value="90"))
-        threshold1 = float(st.text_input(f"Threshold (mV) for dark counts ({label1}):", value="90"))
-        for i, (label, color, threshold) in enumerate([(label0, color0, threshold0), (label1, color1, threshold1)]):
-            time = parsed_data[i]["ardn_time_min"]
-            sipm = parsed_data[i]["sipm"]
-            temp = parsed_data[i]["temperature"]
-            dark_rates = []
-            dark_temps = []
-            curr_time = time[0]
-            start_index = 0
-            for j in range(1, len(time)):
-                if time[j] - curr_time >= 1:
-                    peak = max(sipm[start_index:j+1])
-                    avg_temp = np.mean(temp[start_index:j+1])
-                    duration = time[j] - curr_time
-                    r = (j - start_index) / (duration * 60)
-                    if peak < threshold:
-                        dark_rates.append(r)
-                        dark_temps.append(avg_temp)
-                    curr_time = time[j]
-                    start_index = j
+    # Correlations of independent series stay within about ±2/sqrt(n) of zero
+    noise = 2 / np.sqrt(grid.shape[1])
+    for level in (noise, -noise):
+        fig.add_hline(y=level, line=dict(color="gray", dash="dot"))
+    fig.update_layout(title=f"Rate Cross-correlation with {labels[reference]}",
+                      xaxis_title="Lag [s] (positive: detector follows the reference)",
+                      yaxis_title="Correlation",
+                      width=800,
+                      height=500)
+    show_chart(fig)
+    st.caption(f"{grid.shape[1]} bins of {bin_seconds} s from {pd.Timestamp(start, unit='ms'):%Y-%m-%d %H:%M} on, "
+               f"with the Arduino clocks aligned to the host clock; "
+               f"dotted lines: ±2/√n band of uncorrelated series")
+
+
+#Time window of the detector page, in host time or in Arduino minutes since the start of each run
+#indexes: time index of each run (see timeindex.py), None for compressed runs
+#Returns one (axis, start, end) per run, or None for the whole runs; only the windows are parsed
+def time_range_selector(indexes):
+    if any(index is None or len(index) < 2 for index in indexes):
+        return None  # compressed runs have to be read from the start anyway
+    choice = st.radio("Time range", ["Whole run", "Host time", "Arduino time"], horizontal=True)
+    if choice == "Host time":
+        hosts = [index["host_time_ns"][index["host_time_ns"] != dataparser.MISSING_TIME] for index in indexes]
+        if any(len(host) < 2 for host in hosts):
+            st.write("Not every run has host time stamps, choose a range in Arduino time instead.")
+            return None
+        lo = pd.Timestamp(min(host[0] for host in hosts)).floor("min").to_pydatetime()
+        hi = pd.Timestamp(max(host[-1] for host in hosts)).ceil("min").to_pydatetime()
+        start, end = st.slider("Host time window", min_value=lo, max_value=hi, value=(lo, hi),
+                               step=timedelta(minutes=1), format="YYYY-MM-DD HH:mm")
+        return [("host", pd.Timestamp(start).value, pd.Timestamp(end).value)] * len(indexes)
+    if choice == "Arduino time":
+        firsts = [int(index["ardn_time_ms"][0]) for index in indexes]
+        span = float(np.ceil(max((index["ardn_time_ms"][-1] - first) / 60000 for index, first in zip(indexes, firsts))))
+        start, end = st.slider("Arduino time window [minutes since the start of each run]", min_value=0.0,
+                               max_value=span, value=(0.0, span), step=1.0)
+        return [("ardn", first + int(start * 60000), first + int(end * 60000)) for first in firsts]
+    return None
+
+
+#Event selection of the detector page: range cuts on any parsed column, applied before every chart
+#Returns a list of (column, low, high); cuts left at the full range of the data are dropped
+CUT_COLUMNS = {
+    "sipm": "SiPM peak voltage [mV]",
+    "adc": "ADC value",
+    "temperature": "Temperature [C]",
+    "deadtime": "Deadtime [ms]",
+    "event_number": "Event number",
+    "ardn_time_ms": "Arduino time [min]",
+    "host_time_ns": "Host time",
+}
+
+
+def selection_panel(datasets):
+    cuts = []
+    with st.expander("Event selection"):
+        columns = st.multiselect("Cut on", list(CUT_COLUMNS), format_func=CUT_COLUMNS.get)
+        for column in columns:
+            ranges = [r for r in (selection.column_range(data, column) for data in datasets) if r is not None]
+            if not ranges:
+                continue
+            lo = min(r[0] for r in ranges)
+            hi = max(r[1] for r in ranges)
+            if column == "host_time_ns":
+                start = pd.Timestamp(lo).floor("min").to_pydatetime()
+                end = pd.Timestamp(hi).ceil("min").to_pydatetime()
+                chosen = st.slider(CUT_COLUMNS[column], min_value=start, max_value=end, value=(start, end),
+                                   step=timedelta(minutes=1), format="YYYY-MM-DD HH:mm")
+                low, high = pd.Timestamp(chosen[0]).value, pd.Timestamp(chosen[1]).value
+                full = chosen == (start, end)
+            elif column == "ardn_time_ms":
+                start, end = float(lo // 60000), float(-(-hi // 60000))
+                chosen = st.slider(CUT_COLUMNS[column], min_value=start, max_value=end, value=(start, end), step=1.0)
+                low, high = chosen[0] * 60000, chosen[1] * 60000
+                full = chosen == (start, end)
+            elif np.issubdtype(type(lo), np.integer):
+                chosen = st.slider(CUT_COLUMNS[column], min_value=int(lo), max_value=int(hi), value=(int(lo), int(hi)))
+                low, high = chosen
+                full = chosen == (int(lo), int(hi))
+            else:
+                start, end = float(np.floor(lo)), float(np.ceil(hi))
+                chosen = st.slider(CUT_COLUMNS[column], min_value=start, max_value=end, value=(start, end), step=0.1)
+                low, high = chosen
+                full = chosen == (start, end)
+            if not full:
+                cuts.append((column, low, high))
+    return cuts
+
+
+#Deadtime correction and error bars for the rate charts (see rates.py)
+def rate_options():
+    col1, col2 = st.columns(2)
+    correct_deadtime = col1.checkbox("Correct rates for deadtime", value=True)
+    error_method = col2.radio("Rate error bars (95% CL)", rates.ERROR_METHODS, horizontal=True)
+    return correct_deadtime, error_method
+
+
+#code for data analysis page, for one or any number of detectors
+#All charts read their inputs from one pipeline (see pipeline.py), so each intermediate is computed once per rerun
+
+#Default labels by number of detectors, otherwise "Detector 1", "Detector 2", ...
+DEFAULT_LABELS = {3: ["Fridge", "Room", "Heating Pad"]}
+DEFAULT_COLORS = px.colors.qualitative.D3
+TREND_COLORS = ["#555555", "#888888", "#AAAAAA"]
+
+
+def detectors_home():
+    st.subheader("Mode: Detectors")
+    thedata = st.file_uploader(label="Upload data file(s), one per detector", accept_multiple_files=True)
+
+    if thedata:
+        keys = [upload_key(file) for file in thedata]
+
+        def load(correct_deadtime):
+            time_ranges = time_range_selector([upload_index(file, key) for file, key in zip(thedata, keys)])
+            pipe = detector_pipeline(thedata, keys, correct_deadtime, time_ranges)
+            if time_ranges is None:
+                return pipe, keys
+            return pipe, [range_key(key, time_range) for key, time_range in zip(keys, time_ranges)]
+
+        detector_charts([file.name for file in thedata], load)
+
+
+#Charts of the detector page, for uploaded runs or runs from the catalog
+#load(correct_deadtime) returns the pipeline of the runs and their cache keys (see detector_pipeline, catalog_pipeline)
+def detector_charts(names, load):
+    n = len(names)
+
+    # Coincidence checkbox
+    is_coincidence = n > 1 and st.checkbox("Were the detectors in coincidence mode?")
+
+    # Labels and colors for detectors
+    default_labels = DEFAULT_LABELS.get(n, [f"Detector {i + 1}" for i in range(n)])
+    labels = [st.text_input(f"Label for {names[i]}", value=default_labels[i]) for i in range(n)]
+    colors = [st.color_picker(f"Color for {labels[i]}", value=DEFAULT_COLORS[i % len(DEFAULT_COLORS)]) for i in range(n)]
+    trend_colors = [TREND_COLORS[i % len(TREND_COLORS)] for i in range(n)]
+
+    correct_deadtime, error_method = rate_options()
+    pipe, keys = load(correct_deadtime)
+    cuts = selection_panel(pipe.datasets)
+    if cuts:
+        pipe, keys = selected_pipeline(pipe, keys, cuts, correct_deadtime)
+    empty = [label for label, data in zip(labels, pipe.datasets) if len(data) < 2]
+    if empty:
+        st.warning("Too few events to analyse: " + ", ".join(empty))
+        st.stop()
+    stats_panel(pipe.datasets, labels)
+
+    # ---- Graph: Number of Events Per Minute ----
+    # Counted per minute in the pipeline, so only one bar per minute is sent instead of every event
+    fig_time = go.Figure()
+    for label, color, minute_counts in zip(labels, colors, pipe.each("minute_counts")):
+        fig_time.add_trace(go.Bar(
+            x=np.arange(len(minute_counts)) + 0.5,
+            y=minute_counts,
+            width=1.0,
+            name=label,
+            marker=dict(color=color, line=dict(width=1, color="black")),
+            opacity=0.7,
+            hovertemplate="Time: %{x:.0f} min<br>Events: %{y}<br><extra></extra>"
+        ))
+    fig_time.update_layout(title="Event Count per Minute",
+                           xaxis_title="Time [minutes]",
+                           yaxis_title="Number of Events",
+                           barmode="overlay",
+                           bargap=0.05,
+                           width=800,
+                           height=500)
+    show_chart(fig_time)
+
+    # ---- Graph: SiPM Peak Voltages vs Detection Rate ----
+    # Live-time-corrected rate and peak SiPM voltage in 15 second bins
+    fig_peak = go.Figure()
+    width = pipeline.PEAK_BIN_SECONDS
+    for label, color, counts, peakV, rate in zip(labels, colors, pipe.each("counts", width),
+                                                 pipe.each("max_sipm", width), pipe.each("rate", width)):
+        filled = counts > 0
+        fig_peak.add_trace(go.Histogram(
+            x=peakV[filled],
+            y=rate[filled],
+            name=label,
+            marker=dict(color=color, line=dict(width=1, color="black")),
+            histfunc="sum",
+            opacity=0.7,
+            xbins=dict(size=10),
+            hovertemplate="Peak Voltage: %{x} mV<br>Rate: %{y:.4f} s⁻¹<br><extra></extra>"
+        ))
+    fig_peak.update_layout(title="SiPM Peak Voltages vs Detection Rate",
+                           xaxis_title="Calculated SiPM peak voltage [mV]",
+                           yaxis_title="Rate/bin [s⁻¹]",
+                           barmode="overlay",
+                           bargap=0.05,
+                           width=800,
+                           height=500)
+    show_chart(fig_peak)
+
+    # ---- Graph: Dark Count Rate vs Temperature ----
+    # 1 minute bins whose peak SiPM voltage is below the threshold, with a LOWESS trend
+    fig_dark = go.Figure()
+    thresholds = [float(st.text_input(f"Threshold (mV) for dark counts ({label}):", value="90")) for label in labels]
+    width = pipeline.DARK_BIN_SECONDS
+    for i, det in enumerate(pipe.detectors):
+        rate = det.get("rate", width)
+        counts = det.get("counts", width)
+        dark = (counts > 0) & (det.get("max_sipm", width) < thresholds[i])
+        dark_rates = rate[dark]
+        dark_temps = det.get("mean_temperature", width)[dark]
+        fig_dark.add_trace(go.Scatter(
+            x=dark_temps,
+            y=dark_rates,
+            error_y=rates.error_bars(rate, counts, det.get("live_s", width), error_method, dark),
+            mode="markers",
+            name=labels[i],
+            marker=dict(color=colors[i], size=6)
+        ))
+        if len(dark_rates) > 1:
+            with perf.stage("lowess", detector=i, events=len(dark_rates)):
+                lowess_result = sm.nonparametric.lowess(endog=dark_rates, exog=dark_temps,
+                                                        frac=0.3)  # Smoothing parameter (adjust as needed)
             fig_dark.add_trace(go.Scatter(
-                x=dark_temps,
-                y=dark_rates,
-                mode="markers",
-                name=label,
-                marker=dict(color=color, size=6)
+                x=lowess_result[:, 0],
+                y=lowess_result[:, 1],
+                mode="lines",
+                name=f"{labels[i]} Trend",
+                line=dict(color=colors[i], width=2)
             ))
-        fig_dark.update_layout(title="Dark Count Rate vs Temperature",
-                               xaxis_title="Temperature [°C]",
-                               yaxis_title="Dark Rate [Hz]",
-                               width=800,
-                               height=500)
-        st.plotly_chart(fig_dark, use_container_width=True)
-
-        # ---- Graph: SiPM Voltage vs Time + Trendline ----
+    fig_dark.update_layout(title="Dark Count Rate vs Temperature",
+                           xaxis_title="Temperature [°C]",
+                           yaxis_title="Dark Rate [Hz]",
+                           width=800,
+                           height=500)
+    show_chart(fig_dark)
+
+    # ---- Graph: SiPM Voltage vs Time + Trendline ----
+    def build_trend():
         fig_trend = go.Figure()
-        trend_colors = ["#555555", "#AAAAAA"]
-        for i, (label, color, trend_color) in enumerate(zip([label0, label1], [color0, color1], trend_colors)):
-            time = parsed_data[i]["ardn_time_min"]
-            sipm = parsed_data[i]["sipm"]
-            coeffs = np.polyfit(time, sipm, deg=1)
-            poly = np.poly1d(coeffs)
-            trend_y = poly(time)
-            fig_trend.add_trace(go.Scatter(x=time, y=sipm, mode="lines", name=label,
-                                           line=dict(color=color)))
-            fig_trend.add_trace(go.Scatter(x=time, y=trend_y, mode="lines", name=f"{label} Trend",
-                                           line=dict(color=trend_color, dash="dot")))
+        for det in pipe.detectors:
+            time = det.get("time_min")
+            fig_trend.add_trace(go.Scatter(
+                x=time,
+                y=dataparser.as_float(det.data, "sipm"),
+                mode="lines",
+                hovertemplate="Time elapsed = %{x:.2f} min<br>SiPM voltage = %{y:.2f} mV<extra></extra>"
+            ))
+            # The trend is a straight line, its end points are enough
+            ends = time[[0, -1]] if len(time) else time
+            fig_trend.add_trace(go.Scatter(
+                x=ends,
+                y=np.poly1d(det.get("sipm_trend"))(ends),
+                mode="lines",
+                hovertemplate="Trend (best fit) = %{y:.2f} mV<extra></extra>"
+            ))
         fig_trend.update_layout(title="SiPM Voltage Over Time",
                                 xaxis_title="Time Elapsed (min)",
                                 yaxis_title="SiPM Voltage (mV)",
                                 width=800,
                                 height=500)
-        st.plotly_chart(fig_trend, use_container_width=True)
-
-        # ---- Graph: Muon Count Rate per Second (10s Bins) ----
-        fig_muonrate = go.Figure()
-        trend_colors = ["#555555", "#AAAAAA"]
-
-        for i, (label, color, trend_color) in enumerate(zip([label0, label1], [color0, color1], trend_colors)):
-            time_sec = parsed_data[i]["ardn_time_min"] * 60  # convert minutes to seconds
-            rate_values = []
-            bin_times = []
-
-            bin_size = 10  # seconds
-            curr_time = time_sec[0]
-            start_index = 0
-
-            for j in range(1, len(time_sec)):
-                if time_sec[j] - curr_time >= bin_size:
-                    duration = time_sec[j] - curr_time
-                    rate = (j - start_index) / duration  # Hz
-                    rate_values.append(rate)
-                    bin_times.append(curr_time)
-                    curr_time = time_sec[j]
-                    start_index = j
-
-            # Add bar graph of actual data
-            fig_muonrate.add_trace(go.Bar(
-                x=bin_times,
-                y=rate_values,
-                name=label,
-                marker_color=color,
-                opacity=0.7
-            ))
+        return fig_trend
+    trend_style = []
+    for label, color, trend_color in zip(labels, colors, trend_colors):
+        trend_style += [dict(name=label, line=dict(color=color)),
+                        dict(name=f"{label} Trend", line=dict(color=trend_color, width=3, dash="dot"))]
+    # Built once per set of files, only labels and colours are applied on each rerun
+    cached_chart(figcache.figure_key("sipm_trend", keys), build_trend, traces=trend_style)
+
+    # ---- Graph: Muon Count Rate per Second (10s Bins) ----
+    fig_muonrate = go.Figure()
+    width = pipeline.MUON_BIN_SECONDS
+    for i, det in enumerate(pipe.detectors):
+        rate_values = det.get("rate", width)
+        bin_times = det.get("bin_start_s", width)
+
+        # Add bar graph of actual data
+        fig_muonrate.add_trace(go.Bar(
+            x=bin_times,
+            y=rate_values,
+            error_y=rates.error_bars(rate_values, det.get("counts", width), det.get("live_s", width), error_method),
+            name=labels[i],
+            marker_color=colors[i],
+            opacity=0.7
+        ))
 
-            # Add trendline
-            if len(bin_times) > 1:
-                coeffs = np.polyfit(bin_times, rate_values, deg=1)
-                poly = np.poly1d(coeffs)
-                trend_y = poly(bin_times)
-
-                fig_muonrate.add_trace(go.Scatter(
-                    x=bin_times,
-                    y=trend_y,
-                    mode="lines",
-                    name=f"{label} Trend",
-                    line=dict(color=trend_color, dash="dot")
-                ))
-
-        fig_muonrate.update_layout(title="Muon Count Rate per Second (10s Bins)",
-                                   xaxis_title="Time [seconds]",
-                                   yaxis_title="Muon Rate [Hz]",
-                                   barmode="overlay",
-                                   width=800,
-                                   height=500)
-        st.plotly_chart(fig_muonrate, use_container_width=True)
-
-
-        if is_coincidence:
-            st.markdown("**[TODO] Add coincidence-specific visualizations here.**")
-
-
-#code for data analysis page when using three detectors 
-
-
-def three_home():
-    st.subheader("Mode: Three Detectors (Fridge, Room, Heating Pad)")
-    thedata = st.file_uploader(label="Upload data file(s)", accept_multiple_files=True)
-
-    if thedata and len(thedata) == 3:
-        labels = ["Fridge", "Room", "Heating Pad"]
-        default_colors = ["#1f77b4", "#2ca02c", "#d62728"]
-        parsed_data = {}
-
-        for i, file in enumerate(thedata):
-            event_number, Ardn_time_ms, adc, sipm, deadtime, temperature = getdata(file)
-            ardn_time_min = Ardn_time_ms / 60000.0
-            parsed_data[i] = {
-                "event_number": event_number,
-                "ardn_time_min": ardn_time_min,
-                "adc": adc,
-                "sipm": sipm,
-                "deadtime": deadtime,
-                "temperature": temperature
-            }
-
-        label_inputs = [st.text_input(f"Label for {labels[i]}", value=labels[i]) for i in range(3)]
-        color_inputs = [st.color_picker(f"Color for {labels[i]}", value=default_colors[i]) for i in range(3)]
-
-        # ---- Graph: Number of Events Per Minute ----
-        fig_time = go.Figure()
-        for i in range(3):
-            time = parsed_data[i]["ardn_time_min"]
-            fig_time.add_trace(go.Histogram(
-                x=time,
-                name=label_inputs[i],
-                marker_color=color_inputs[i],
-                opacity=0.7,
-                xbins=dict(size=1.0)
-            ))
-        fig_time.update_layout(title="Event Count per Minute",
-                               xaxis_title="Time [minutes]",
-                               yaxis_title="Number of Events",
-                               barmode="overlay",
-                               width=800,
-                               height=500)
-        st.plotly_chart(fig_time, use_container_width=True)
-
-        # ---- Graph: SiPM Peak Voltages vs Detection Rate ----
-        fig_peak = go.Figure()
-        for i in range(3):
-            time = parsed_data[i]["ardn_time_min"]
-            sipm = parsed_data[i]["sipm"]
-            rate, peakV = [], []
-            bin_size = 0.25
-            curr_time = time[0]
-            start_index = 0
-            peak = 0
-            for j in range(1, len(time)):
-                if time[j] - curr_time >= bin_size:
-                    peak = max(sipm[peak:(j+1)])
-                    duration = time[j] - curr_time
-                    r = (j - start_index) / (duration * 60)
-                    rate.append(r)
-                    peakV.append(peak)
-                    curr_time = time[j]
-                    start_index = j
-                    peak = j
-            fig_peak.add_trace(go.Histogram(
-                x=peakV,
-                y=rate,
-                name=label_inputs[i],
-                marker_color=color_inputs[i],
-                histfunc="sum",
-                opacity=0.7,
-                xbins=dict(size=10)
+        # Add trendline
+        if len(bin_times) > 1:
+            ends = bin_times[[0, -1]]
+            fig_muonrate.add_trace(go.Scatter(
+                x=ends,
+                y=np.poly1d(det.get("rate_trend", width))(ends),
+                mode="lines",
+                name=f"{labels[i]} Trend",
+                line=dict(color=trend_colors[i], dash="dot")
             ))
-        fig_peak.update_layout(title="SiPM Peak Voltages vs Detection Rate",
-                               xaxis_title="Calculated SiPM peak voltage [mV]",
-                               yaxis_title="Rate/bin [s⁻¹]",
+
+    fig_muonrate.update_layout(title="Muon Count Rate per Second (10s Bins)",
+                               xaxis_title="Time [seconds]",
+                               yaxis_title="Muon Rate [Hz]",
                                barmode="overlay",
                                width=800,
                                height=500)
-        st.plotly_chart(fig_peak, use_container_width=True)
-
-        # ---- Graph: Dark Count Rate vs Temperature ----
-        fig_dark = go.Figure()
-        thresholds = [float(st.text_input(f"Threshold (mV) for dark counts ({label_inputs[i]}):", value="90")) for i in range(3)]
-
-        for i in range(3):
-            time = parsed_data[i]["ardn_time_min"]
-            sipm = parsed_data[i]["sipm"]
-            temp = parsed_data[i]["temperature"]
-            dark_rates = []
-            dark_temps = []
-            curr_time = time[0]
-            start_index = 0
-            for j in range(1, len(time)):
-                if time[j] - curr_time >= 1:
-                    peak = max(sipm[start_index:j+1])
-                    avg_temp = np.mean(temp[start_index:j+1])
-                    duration = time[j] - curr_time
-                    r = (j - start_index) / (duration * 60)
-                    if peak < thresholds[i]:
-                        dark_rates.append(r)
-                        dark_temps.append(avg_temp)
-                    curr_time = time[j]
-                    start_index = j
-            fig_dark.add_trace(go.Scatter(
-                x=dark_temps,
-                y=dark_rates,
-                mode="markers",
-                name=label_inputs[i],
-                marker=dict(color=color_inputs[i], size=6)
+    show_chart(fig_muonrate)
+
+    # ---- Graphs: Clock drift and cross-correlation of the rates, on the common timebase ----
+    if n > 1:
+        times = clock_alignment(pipe, keys, labels, colors)
+        cross_correlation_chart(times, labels, colors)
+
+    # ---- Graph: Signals by Time of Day ----
+    time_of_day_charts(pipe.each("host_time"), labels, colors)
+
+    if is_coincidence:
+        st.markdown("**[TODO] Add coincidence-specific visualizations here.**")
+
+
+#Runs from the data directory on the server (see catalog.py): filter the catalog, then analyse runs without uploading them
+def catalog_home():
+    st.subheader("Mode: Run Catalog")
+    st.caption(f"Runs in {os.path.abspath(catalog.DATA_DIR)}")
+    if st.button("Rescan the data directory") or "catalog_scanned" not in st.session_state:
+        with st.spinner("Scanning for new and changed runs..."):
+            with perf.stage("catalog scan") as record:
+                try:
+                    counts = catalog.scan(pool=detector_pool())
+                except BrokenProcessPool:
+                    detector_pool.clear()  # a worker died, start a new pool on the next run and parse here for now
+                    counts = catalog.scan()
+                record.update(counts)
+        st.session_state["catalog_scanned"] = counts
+    counts = st.session_state["catalog_scanned"]
+    st.write(f"{counts['added']} runs added, {counts['updated']} updated, {counts['removed']} removed, "
+             f"{counts['unchanged']} unchanged" + (f"; {counts['failed']} could not be read" if counts["failed"] else ""))
+
+    col1, col2, col3 = st.columns(3)
+    device = col1.selectbox("Device", ["All"] + catalog.devices())
+    dates = col2.date_input("Recorded between", value=())
+    min_events = col3.number_input("At least this many events", min_value=0, value=100, step=100)
+    start_ns = end_ns = None
+    if len(dates) == 2:
+        start_ns = pd.Timestamp(dates[0]).value
+        end_ns = (pd.Timestamp(dates[1]) + pd.Timedelta(days=1)).value
+    rows = catalog.runs(device_id=None if device == "All" else device, start_ns=start_ns, end_ns=end_ns,
+                        min_events=min_events)
+    if not rows:
+        st.write("No runs match.")
+        return
+
+    table = pd.DataFrame(rows)
+    table["start"] = pd.to_datetime(table["start_ns"])
+    table["end"] = pd.to_datetime(table["end_ns"])
+    st.dataframe(table[["path", "device_id", "start", "end", "events", "mean_rate", "temperature_min", "temperature_max"]],
+                 hide_index=True)
+    chosen = st.multiselect("Runs to analyse, one per detector", range(len(rows)), format_func=lambda i: rows[i]["path"])
+    if chosen:
+        chosen_rows = [rows[i] for i in chosen]
+        keys = [catalog.run_key(row) for row in chosen_rows]
+
+        def load(correct_deadtime):
+            time_ranges = time_range_selector([catalog_index(row) for row in chosen_rows])
+            pipe = catalog_pipeline(chosen_rows, correct_deadtime, time_ranges)
+            if time_ranges is None:
+                return pipe, keys
+            return pipe, [range_key(key, time_range) for key, time_range in zip(keys, time_ranges)]
+
+        detector_charts([row["path"] for row in chosen_rows], load)
+
+
+#code for comparing many runs tagged by experimental condition
+
+
+def compare_home():
+    st.subheader("Mode: Multi-run Comparison")
+    thedata = st.file_uploader(label="Upload data files", accept_multiple_files=True)
+
+    if thedata:
+        experiment_type = st.radio("Choose experiment type:", ["Altitude", "Shielding", "Magnetic field", "Temperature", "Other"],
+                                   horizontal=True)
+
+        # Tag every run with its condition; runs with the same tag are pooled
+        tags = st.data_editor(
+            pd.DataFrame({"file": [file.name for file in thedata], "condition": [file.name.rsplit(".", 1)[0] for file in thedata]}),
+            disabled=["file"],
+            hide_index=True,
+            use_container_width=True
+        )
+        conditions = [str(condition) for condition in tags["condition"]]
+        bin_seconds = st.number_input("Bin width [s]", min_value=1, value=60)
+
+        # Rates of runs seen before come from the dataset cache, the rest are parsed and binned in parallel
+        # on the worker processes of the detector page (see detector_pool)
+        cache = dataset_cache()
+        keys = [datacache.content_key(file.getbuffer(), prefix=f"rates{bin_seconds}") for file in thedata]
+        binned_rates = [cache.lookup(key) for key in keys]
+        missing = [i for i, run_rates in enumerate(binned_rates) if run_rates is None]
+        if missing:
+            raws = [thedata[i].getvalue() for i in missing]
+            with st.spinner(f"Parsing {len(missing)} runs..."):
+                with perf.stage("parse + bin (workers)", runs=len(missing), bytes_in=sum(len(raw) for raw in raws)):
+                    try:
+                        fresh = comparison.bin_runs(raws, bin_seconds, detector_pool())
+                    except BrokenProcessPool:
+                        detector_pool.clear()  # a worker died, start a new pool on the next run and bin here for now
+                        fresh = comparison.bin_runs(raws, bin_seconds)
+            for i, run_rates in zip(missing, fresh):
+                cache.put(keys[i], run_rates)
+                binned_rates[i] = run_rates
+
+        # ---- Table: Rate per Condition ----
+        summary = comparison.condition_summary(conditions, binned_rates)
+        st.dataframe(summary, hide_index=True, use_container_width=True)
+
+        # ---- Graph: Rate Distribution per Condition with Error Bars ----
+        fig_cond = go.Figure()
+        for condition, pooled in comparison.condition_rates(conditions, binned_rates).items():
+            fig_cond.add_trace(go.Violin(
+                x=[condition] * len(pooled),
+                y=pooled,
+                name=condition,
+                box_visible=True,
+                meanline_visible=True,
+                opacity=0.6
             ))
-        fig_dark.update_layout(title="Dark Count Rate vs Temperature",
-                               xaxis_title="Temperature [°C]",
-                               yaxis_title="Dark Rate [Hz]",
+        fig_cond.add_trace(go.Scatter(
+            x=summary["condition"],
+            y=summary["mean rate [Hz]"],
+            error_y=dict(type="data", array=summary["sem [Hz]"], visible=True),
+            mode="markers",
+            name="Mean ± SEM",
+            marker=dict(color="black", size=9, symbol="diamond")
+        ))
+        fig_cond.update_layout(title=f"Muon Rate per Condition ({experiment_type}, {bin_seconds} s Bins)",
+                               xaxis_title=experiment_type,
+                               yaxis_title="Rate [Hz]",
                                width=800,
                                height=500)
-        st.plotly_chart(fig_dark, use_container_width=True)
+        show_chart(fig_cond)
 
-        # ---- Graph: SiPM Voltage vs Time + Trendline ----
-        fig_trend = go.Figure()
-        trend_colors = ["#555555", "#888888", "#AAAAAA"]
-        for i in range(3):
-            time = parsed_data[i]["ardn_time_min"]
-            sipm = parsed_data[i]["sipm"]
-            coeffs = np.polyfit(time, sipm, deg=1)
-            poly = np.poly1d(coeffs)
-            trend_y = poly(time)
-            fig_trend.add_trace(go.Scatter(x=time, y=sipm, mode="lines", name=label_inputs[i],
-                                           line=dict(color=color_inputs[i])))
-            fig_trend.add_trace(go.Scatter(x=time, y=trend_y, mode="lines", name=f"{label_inputs[i]} Trend",
-                                           line=dict(color=trend_colors[i], dash="dot")))
-        fig_trend.update_layout(title="SiPM Voltage Over Time",
-                                xaxis_title="Time Elapsed (min)",
-                                yaxis_title="SiPM Voltage (mV)",
-                                width=800,
-                                height=500)
-        st.plotly_chart(fig_trend, use_container_width=True)
+
+#Performance expander: stages of this rerun as timed by perf.stage, plus the captured profile if one was requested
+
+
+def perf_panel(recorder, profile_path=None):
+    with st.expander("Performance", expanded=profile_path is not None):
+        st.markdown(f"**{recorder.page}**: {recorder.total_seconds():.3f} s in total, {len(recorder.records)} timed stages")
+        if recorder.records:
+            stages = pd.DataFrame(recorder.records)
+            st.dataframe(stages, hide_index=True, use_container_width=True)
+            st.dataframe(stages.groupby("stage")["seconds"].agg(["count", "sum"]).sort_values("sum", ascending=False),
+                         use_container_width=True)
+        if profile_path is not None:
+            with open(profile_path, "rb") as prof:
+                st.download_button("Download profile (.prof, open with snakeviz or pstats)", prof,
+                                   file_name=os.path.basename(profile_path))
+        st.caption(f"Each rerun is appended to {os.path.join(perf.PERF_DIR, 'perf_log.jsonl')}")
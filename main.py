@@ -5,6 +5,7 @@ import sys
 import os
 import os.path
 import signal
+import json
 from datetime import datetime
 from multiprocessing import Process
 
@@ -19,6 +20,11 @@ import math
 import random
 import _thread as thread
 
+import anomaly
+import coincidence
+import replay
+import timeindex
+
 '''
 This is a Websocket server that forwards signals from the detector to any client connected.
 It requires Tornado python library to work properly.
@@ -42,7 +48,14 @@ def print_help1():
 
 
 clients = [] ## list of clients connected
+alert_clients = [] ## list of clients connected to the alert channel
 queue = multiprocessing.Queue() #queue for events forwarded from the device
+monitor = anomaly.StreamMonitor() #online rate, spectrum and temperature checks of the forwarded events
+ALERT_LOG = 'CW_alerts.log'
+tagger = None #coincidence tagger of the recorder when recording from several detectors
+index = None #time index sidecar of the recorded file, see timeindex.py
+player = None #recorded run replayed through the server in mode 5, see replay.py
+REPLAY_TICK = 10 #ms between checks for replayed frames that are due
 
 class DataCollectionProcess(multiprocessing.Process):
     def __init__(self, queue):
@@ -72,12 +85,12 @@ class WSHandler(tornado.websocket.WebSocketHandler):
         self.sending = False
 
     def open(self):
-        print("New connection opened from ") + self.request.remote_ip
+        print("New connection opened from " + self.request.remote_ip)
         clients.append(self)
-        print("%d clients connected") % len(clients)
+        print("%d clients connected" % len(clients))
       
     def on_message(self, message):
-        print("message received:  %s") % message
+        print("message received:  %s" % message)
         if message == 'StartData':
             self.sending = True
         if message == 'StopData':
@@ -86,25 +99,111 @@ class WSHandler(tornado.websocket.WebSocketHandler):
     def on_close(self):
         self.sending = False
         clients.remove(self)
-        print("Connection closed from ") + self.request.remote_ip
-        print("%d clients connected") % len(clients)
+        print("Connection closed from " + self.request.remote_ip)
+        print("%d clients connected" % len(clients))
  
     def check_origin(self, origin):
         return True
 
+class AlertHandler(tornado.websocket.WebSocketHandler):
+    # Separate channel (ws://host:9090/alerts) with one JSON object per alert raised or cleared, see anomaly.py
+    def open(self):
+        alert_clients.append(self)
+
+    def on_close(self):
+        alert_clients.remove(self)
+
+    def check_origin(self, origin):
+        return True
+
+def sendAlerts(alerts):
+    if not alerts:
+        return
+    with open(ALERT_LOG, 'a') as log:
+        for alert in alerts:
+            message = json.dumps(alert)
+            log.write(message + '\n')
+            print('ALERT ' + alert['state'] + ': ' + alert['detector'] + ' ' + alert['kind'])
+            for client in alert_clients:
+                client.write_message(message)
+
+def broadcast(message, name):
+    for client in clients:
+        if client.sending:
+            try:
+                client.write_message(message)
+            except tornado.websocket.WebSocketClosedError:
+                pass # closed but on_close has not run yet
+    return monitor.update_frame(message, name)
+
 def checkQueue():
+    alerts = []
     while not queue.empty():
         message = queue.get()
         ##sys.stdout.write('#')
-        for client in clients:
-            if client.sending:
-                client.write_message(message)
+        alerts += broadcast(message, port_name_list[0])
+    alerts += monitor.check(time.time())
+    sendAlerts(alerts)
+
+def checkReplay():
+    alerts = []
+    for message in player.due(time.time()):
+        alerts += broadcast(message, 'replay')
+    alerts += monitor.check(time.time())
+    sendAlerts(alerts)
+    if player.finished:
+        print('Replay finished: %d events sent' % player.sent)
+        tornado.ioloop.IOLoop.current().stop()
+
+def startServer(callback, period):
+    application = tornado.web.Application(
+        handlers=[(r'/', WSHandler), (r'/alerts', AlertHandler)]
+    )
+    http_server = tornado.httpserver.HTTPServer(application)
+    port = 9090
+    http_server.listen(port)
+    myIP = socket.gethostbyname(socket.gethostname())
+    print("CosmicWatch detector server started at %s:%d" % (myIP, port))
+    print("Alerts are sent on ws://%s:%d/alerts and logged to %s" % (myIP, port, ALERT_LOG))
+    print("You can now connect to your device using http://cosmicwatch.lns.mit.edu/")
+    mainLoop = tornado.ioloop.IOLoop.instance()
+    #in the main loop fire the callback every period ms
+    try:
+        scheduler = tornado.ioloop.PeriodicCallback(callback, period, io_loop = mainLoop)
+    except:
+        # io_loop arguement was removed in version 5.x of Tornado.
+        scheduler = tornado.ioloop.PeriodicCallback(callback, period)
+    scheduler.start()
+    #start the loop
+    mainLoop.start()
  
 
+def writeEvent(line):
+    offset = file.tell()
+    file.write(line+'\n')
+    if index is not None:
+        index.line(offset, line)
+
 def signal_handler(signal, frame):
         print('You pressed Ctrl+C!')
-        ComPort.close()     
-        file.close() 
+        try:
+            if tagger is not None:
+                # events still waiting for a possible coincidence partner
+                for line, group in tagger.drain():
+                    writeEvent(line+" "+str(group))
+        finally:
+            # the data file and its index are closed (and flushed) first, whatever happens to the ports
+            if 'file' in globals():
+                file.close()
+            if index is not None:
+                index.close()
+            # mode 1 reads from Det0, Det1, ..., modes 2 and 3 from ComPort
+            for name in list(globals()):
+                if name == 'ComPort' or (name.startswith('Det') and name[3:].isdigit()):
+                    try:
+                        globals()[name].close()
+                    except (OSError, serial.SerialException):
+                        pass
         sys.exit(0)
 def serial_ports():
     """ Lists serial port names
@@ -145,6 +244,7 @@ print("[1] Record data on the computer")
 print("[2] Copy data files from SD card to your computer")
 print("[3] Remove files from SD card")
 print("[4] Connect to server: www.cosmicwatch.lns.mit.edu")
+print("[5] Replay a recorded run through the server (no detector needed)")
 print("[h] Help")
 
 mode = str(input("\nSelected operation: "))
@@ -155,12 +255,41 @@ if mode == 'h':
 
 else:
     mode = int(mode)
-    if mode not in [1,2,3,4]:
+    if mode not in [1,2,3,4,5]:
         print('-- Error --')
         print('Invalid selection')
         print('Exiting...')
         sys.exit()
 
+if mode == 5:
+    # a replay needs no serial port, so it starts before the ports are listed
+    cwd = os.getcwd()
+    fname = input("Enter the run to replay, text or binary (default: "+cwd+"/CW_data.txt):")
+    if fname == '':
+        fname = cwd+"/CW_data.txt"
+    speed = input("Speed multiplier, or 'max' for as fast as possible (default: 1):")
+    try:
+        speed = None if speed == 'max' else float(speed or 1)
+    except ValueError:
+        speed = 0
+    if speed is not None and not speed > 0:
+        print('--- Error ---')
+        print('The speed multiplier has to be a number larger than 0, or max.')
+        print('Exiting ...')
+        sys.exit()
+    loop = input("Loop the run? Type y or n (default: n): ") in ['y', 'yes', 'Y', 'YES']
+    try:
+        seconds, frames = replay.load_run(fname)
+    except (OSError, ValueError) as error:
+        print('--- Error ---')
+        print(error)
+        print('Exiting ...')
+        sys.exit()
+    print('Replaying %d events (%.1f minutes recorded) from %s' % (len(frames), seconds[-1]/60, fname))
+    player = replay.Replay(seconds, frames, speed, loop)
+    startServer(checkReplay, REPLAY_TICK)
+    sys.exit()
+
 port_list = serial_ports()
 
 print('Available serial ports:')
@@ -206,6 +335,11 @@ if mode == 1:
 
     print('Saving data to: '+fname)
 
+    if nDetectors > 1:
+        window = input("Coincidence window in ms (default: "+str(int(coincidence.WINDOW*1000))+"):")
+        window = float(window)/1000 if window != '' else coincidence.WINDOW
+        tagger = coincidence.CoincidenceTagger(nDetectors, window)
+
     ComPort_list = np.ones(nDetectors)
     for i in range(nDetectors):
         signal.signal(signal.SIGINT, signal_handler)
@@ -254,6 +388,9 @@ if mode == 1:
     file.write(header3)
     file.write(header4)
     file.write(header5)
+    if tagger is not None:
+        # before the Device line, which has to stay the last header line
+        file.write('Coincidence window: '+str(tagger.window*1000)+' ms, last column: coincidence group ID (0: none)\n')
 
     string_of_names = ''
     print("\n-- Detector Names --")
@@ -279,19 +416,38 @@ if mode == 1:
     #print(string_of_names)
     file.write('Device ID(s): '+string_of_names)
     file.write('\n')
+    index = timeindex.IndexWriter(fname, file)
     #detector_name = ComPort.readline().decode("utf-8", "ignore")    # Wait and read data 
     #file.write("Device ID: "+str(detector_name))
 
+    start_time = time.time()
+    last_report = start_time
     while True:
         for i in range(nDetectors):
             if globals()['Det%s' % str(i)].inWaiting():
                 data = globals()['Det%s' % str(i)].readline().decode("utf-8", "ignore").replace('\r\n','')    # Wait and read data 
-                file.write(str(datetime.now())+" "+data+" "+detector_name_list[i]+'\n')
+                now = datetime.now()
+                line = str(now)+" "+data+" "+detector_name_list[i]
+                if tagger is not None:
+                    tagger.add(i, now.timestamp(), line)
+                else:
+                    writeEvent(line)
                 globals()['Det%s' % str(i)].write('got-it') 
+        if tagger is not None:
+            # write the events that are older than the window, with their coincidence group
+            now = time.time()
+            for line, group in tagger.ready(now):
+                writeEvent(line+" "+str(group))
+            if now - last_report > 10:
+                minutes = (now - start_time)/60
+                print('\rCoincidences: %d (%.2f per minute), %d of %d events tagged' %
+                      (tagger.groups, tagger.groups/minutes, tagger.coincident_events, tagger.events), end='')
+                last_report = now
 
     for i in range(nDetectors):
         globals()['Det%s' % str(i)].close()     
     file.close()  
+    index.close()
 
 if mode == 2:
     
@@ -393,26 +549,8 @@ if mode == 4:
     thread.start_new_thread(RUN,(bg,)) 
     #p=multiprocessing.Process(target=RUN)
     #p.start()
-    #server stuff
-    application = tornado.web.Application(
-        handlers=[(r'/', WSHandler)]
-    )
-    http_server = tornado.httpserver.HTTPServer(application)
-    port = 9090
-    http_server.listen(port)
-    myIP = socket.gethostbyname(socket.gethostname())
-    print("CosmicWatch detector server started at %s:%d") % (myIP, port)
-    print("You can now connect to your device using http://cosmicwatch.lns.mit.edu/")
-    mainLoop = tornado.ioloop.IOLoop.instance()
-    #in the main loop fire queue check each 100ms
-    try:
-        scheduler = tornado.ioloop.PeriodicCallback(checkQueue, 100, io_loop = mainLoop)
-    except:
-        # io_loop arguement was removed in version 5.x of Tornado.
-        scheduler = tornado.ioloop.PeriodicCallback(checkQueue, 100)
-    scheduler.start()
-    #start the loop
-    mainLoop.start()
+    #server stuff, check the queue each 100ms
+    startServer(checkQueue, 100)
 
 
 
@@ -0,0 +1,28 @@
+#admin page: state of the shared dataset cache on this server
+
+import streamlit as st
+
+import homepages
+
+st.title("Admin")
+st.subheader("Dataset cache")
+
+stats = homepages.dataset_cache().stats()
+lookups = stats["hits"] + stats["misses"]
+
+col1, col2, col3 = st.columns(3)
+col1.metric("Resident", f"{stats['resident_bytes'] / 2**20:.1f} MB", f"of {stats['max_bytes'] / 2**20:.0f} MB", delta_color="off")
+col2.metric("Datasets", stats["entries"])
+col3.metric("Hit rate", f"{stats['hits'] / lookups:.0%}" if lookups else "n/a")
+
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Hits", stats["hits"])
+col2.metric("Misses", stats["misses"])
+col3.metric("Evictions", stats["evictions"])
+col4.metric("Expirations", stats["expirations"])
+
+st.caption(f"Time-to-live: {stats['ttl']:.0f} s" if stats["ttl"] else "Time-to-live: none")
+
+if st.button("Clear dataset cache"):
+    homepages.dataset_cache().clear()
+    st.rerun()
@@ -0,0 +1,132 @@
+#Per-stage timing of the analysis pages: time, event counts, bytes in/out and peak memory of each stage
+#When instrumentation is off, perf.stage() hands back one shared no-op context, so it costs a function call
+
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+#Where the metrics log and captured profiles go
+PERF_DIR = os.environ.get("CHARM_PERF_DIR", "perf")
+
+_local = threading.local()  # Streamlit runs each session's script in its own thread
+
+#tracemalloc is process-wide while recorders are per session: it runs while any recorder tracks memory
+_tracing_users = 0
+_tracing_lock = threading.Lock()
+
+
+class _NullStage:
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, recorder, name, fields):
+        self.recorder = recorder
+        self.record = dict(stage=name, **fields)
+
+    def __enter__(self):
+        if self.recorder.track_memory:
+            tracemalloc.reset_peak()
+            self.start_bytes = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self.record
+
+    def __exit__(self, *exc):
+        self.record["seconds"] = time.perf_counter() - self.start
+        if self.recorder.track_memory:
+            # Peak allocated on top of what was already held when the stage started
+            self.record["peak_bytes"] = tracemalloc.get_traced_memory()[1] - self.start_bytes
+        self.recorder.records.append(self.record)
+        return False
+
+
+class Recorder:
+    """Stage records of one rerun of one page."""
+
+    def __init__(self, page, track_memory=False):
+        self.page = page
+        self.track_memory = track_memory
+        self.records = []
+        self.started = time.time()
+
+    def total_seconds(self):
+        return time.time() - self.started
+
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def begin(page, enabled, track_memory=False):
+    """Start recording a rerun in this thread; returns the recorder, or None when disabled.
+
+    Pair every begin() with an end() in a finally block, so memory tracing stops even if the page raises.
+    """
+    if getattr(_local, "recorder", None) is not None:
+        end()  # left over from a rerun that never reached end()
+    recorder = Recorder(page, track_memory) if enabled else None
+    if recorder is not None and track_memory:
+        _start_tracing()
+    _local.recorder = recorder
+    return recorder
+
+
+def end():
+    """Stop recording and append the rerun to the metrics log (one JSON object per line)."""
+    recorder = getattr(_local, "recorder", None)
+    _local.recorder = None
+    if recorder is None:
+        return None
+    if recorder.track_memory:
+        _stop_tracing()
+    os.makedirs(PERF_DIR, exist_ok=True)
+    with open(os.path.join(PERF_DIR, "perf_log.jsonl"), "a") as log:
+        log.write(json.dumps({
+            "time": datetime.now().isoformat(),
+            "page": recorder.page,
+            "total_seconds": recorder.total_seconds(),
+            "stages": recorder.records,
+        }, default=str) + "\n")
+    return recorder
+
+
+def stage(name, **fields):
+    """Time a block as one stage. Extra fields (events, bytes_in, ...) are stored with it and
+    the record is returned by `with`, so bytes_out and the like can be filled in inside the block."""
+    recorder = getattr(_local, "recorder", None)
+    if recorder is None:
+        return _NULL_STAGE
+    return _Stage(recorder, name, fields)
+
+
+def profile(function, *args):
+    """Run function(*args) under cProfile and save the stats; returns the path of the .prof file."""
+    profiler = cProfile.Profile()
+    profiler.runcall(function, *args)
+    os.makedirs(PERF_DIR, exist_ok=True)
+    path = os.path.join(PERF_DIR, datetime.now().strftime("rerun-%Y%m%d-%H%M%S.prof"))
+    profiler.dump_stats(path)
+    return path
@@ -0,0 +1,259 @@
+#Analysis pipeline of the detector page, for any number of detectors
+#Every analysis is a stage that names the stages it takes as input, so intermediates used by several charts
+#(the integer time axis, the bin index of each bin width, ...) are computed once per detector and rerun
+
+import numpy as np
+
+import clockalign
+import perf
+import timeofday
+
+#Bin widths in seconds of the rate charts
+PEAK_BIN_SECONDS = 15
+DARK_BIN_SECONDS = 60
+MUON_BIN_SECONDS = 10
+
+#name -> Stage, filled by the @stage decorator below
+STAGES = {}
+
+
+class Stage:
+    def __init__(self, function, inputs, binned, events):
+        self.function = function
+        self.inputs = inputs
+        self.binned = binned
+        self.events = events
+
+
+def stage(*inputs, binned=False, events=False):
+    """Register a function as a stage, called with the detector's pipeline followed by the outputs of inputs.
+
+    binned stages are computed per bin width and also get the width in seconds as last argument;
+    their binned inputs are taken at the same width. events marks a pass over the event arrays.
+    """
+    def register(function):
+        STAGES[function.__name__] = Stage(function, inputs, binned, events)
+        return function
+    return register
+
+
+def stage_key(name, width=None):
+    return name if width is None else f"{name}@{width}s"
+
+
+def _width_ms(width):
+    return int(round(width * 1000))
+
+
+def fit_line(x, y):
+    """Coefficients of a straight-line fit, highest power first (NaN with fewer than two points)."""
+    if len(x) < 2:
+        return np.full(2, np.nan)
+    return np.polyfit(x, y, deg=1)
+
+
+@stage(events=True)
+def time_ms(det):
+    """Arduino time stamps in ms as int64, continued past the wrap of the uint32 millis() counter."""
+    return clockalign.unwrap_ms(det.data["ardn_time_ms"])
+
+
+@stage("time_ms", events=True)
+def time_min(det, time_ms):
+    """Arduino time in minutes as float64, continued past the wrap like time_ms."""
+    return time_ms / 60000.0
+
+
+@stage("time_ms", events=True)
+def minute_counts(det, time_ms):
+    """Events in each minute of Arduino time, counted from 0 like the old per-minute histogram."""
+    return np.bincount(time_ms // 60000)
+
+
+@stage("time_ms", binned=True)
+def n_bins(det, time_ms, width):
+    """Number of complete bins: bins start at the first event and the last, incomplete bin is dropped."""
+    return max(int((time_ms.max() - time_ms[0]) // _width_ms(width)), 0) if len(time_ms) else 0
+
+
+@stage("time_ms", "n_bins", binned=True, events=True)
+def bin_index(det, time_ms, n_bins, width):
+    """Bin of each event, n_bins for the events outside the complete bins.
+
+    Those are the events of the last bin, and events before the first one: Arduino time goes back after a
+    reset mid-run, and when one file interleaves the clocks of several detectors (mode 1).
+    So the bins are not assumed to be in order, and stages count them with n_bins + 1 bins and drop the last.
+    """
+    bins = (time_ms - time_ms[0]) // _width_ms(width)
+    bins[(bins < 0) | (bins > n_bins)] = n_bins
+    return bins
+
+
+@stage("bin_index", "n_bins", binned=True, events=True)
+def counts(det, bin_index, n_bins, width):
+    return np.bincount(bin_index, minlength=n_bins + 1)[:n_bins]
+
+
+@stage("bin_index", "n_bins", binned=True, events=True)
+def live_s(det, bin_index, n_bins, width):
+    """Live time of each bin in seconds.
+
+    The deadtime column is the detector's running total, so the deadtime of a bin is the sum of its
+    increases from one event to the next over the bin, and the live time is the bin width minus it.
+    The total starts again from 0 after a reset, where the increase is the new total itself.
+    """
+    width_ms = _width_ms(width)
+    if not det.correct_deadtime or not n_bins:
+        return np.full(n_bins, width_ms / 1000.0)
+    deadtime = det.data["deadtime"].astype(np.int64)
+    increase = np.diff(deadtime, prepend=deadtime[:1])
+    increase = np.where(increase < 0, deadtime, increase)
+    dead_ms = np.bincount(bin_index, weights=increase, minlength=n_bins + 1)[:n_bins]
+    return np.clip(width_ms - dead_ms, 1, width_ms) / 1000.0
+
+
+@stage("counts", "live_s", binned=True)
+def rate(det, counts, live_s, width):
+    return counts / live_s
+
+
+@stage("time_ms", "n_bins", binned=True)
+def bin_start_s(det, time_ms, n_bins, width):
+    """Start of each bin in seconds of Arduino time."""
+    start = time_ms[0] if len(time_ms) else 0
+    return (start + np.arange(n_bins) * _width_ms(width)) / 1000.0
+
+
+@stage("bin_index", "counts", binned=True, events=True)
+def max_sipm(det, bin_index, counts, width):
+    """Largest SiPM voltage in each bin, NaN for empty bins."""
+    out = np.full(len(counts), np.nan)
+    filled = counts > 0
+    if not filled.any():
+        return out
+    sipm = det.data["sipm"]
+    if np.all(bin_index[1:] >= bin_index[:-1]):
+        # Bins in order: one reduction over the runs of equal bins
+        end = np.searchsorted(bin_index, len(counts))
+        out[filled] = np.maximum.reduceat(sipm[:end], np.searchsorted(bin_index, np.flatnonzero(filled)))
+    else:
+        peak = np.full(len(counts) + 1, -np.inf)
+        np.maximum.at(peak, bin_index, sipm)
+        out[filled] = peak[:-1][filled]
+    return out
+
+
+@stage("bin_index", "counts", binned=True, events=True)
+def mean_temperature(det, bin_index, counts, width):
+    """Mean temperature in each bin, NaN for empty bins."""
+    sums = np.bincount(bin_index, weights=det.data["temperature"], minlength=len(counts) + 1)[:len(counts)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return sums / counts
+
+
+@stage("bin_start_s", "rate", binned=True)
+def rate_trend(det, bin_start_s, rate, width):
+    return fit_line(bin_start_s, rate)
+
+
+@stage("time_min", events=True)
+def sipm_trend(det, time_min):
+    return fit_line(time_min, det.data["sipm"])
+
+
+@stage(events=True)
+def host_time(det):
+    """Valid host time stamps, sorted (see timeofday.valid_host_time)."""
+    return timeofday.valid_host_time(det.data)
+
+
+@stage("time_ms", events=True)
+def clock_fit(det, time_ms):
+    """Knots of the detector's Arduino clock against the host clock (see clockalign.fit_clock)."""
+    return clockalign.fit_clock(time_ms, det.data["host_time_ns"])
+
+
+@stage("time_ms", "clock_fit", events=True)
+def aligned_ms(det, time_ms, clock_fit):
+    """Event times on the timebase shared by all detectors: int64 ms of host time."""
+    return clockalign.apply_clock(time_ms, clock_fit)
+
+
+#Outputs the detector page needs from every run; computed together by the worker pool and kept in the dataset cache
+PRECOMPUTED = [
+    ("minute_counts", None),
+    ("sipm_trend", None),
+    ("counts", PEAK_BIN_SECONDS), ("rate", PEAK_BIN_SECONDS), ("max_sipm", PEAK_BIN_SECONDS),
+    ("counts", DARK_BIN_SECONDS), ("live_s", DARK_BIN_SECONDS), ("rate", DARK_BIN_SECONDS),
+    ("max_sipm", DARK_BIN_SECONDS), ("mean_temperature", DARK_BIN_SECONDS),
+    ("counts", MUON_BIN_SECONDS), ("live_s", MUON_BIN_SECONDS), ("rate", MUON_BIN_SECONDS),
+    ("bin_start_s", MUON_BIN_SECONDS), ("rate_trend", MUON_BIN_SECONDS),
+    ("clock_fit", None),
+]
+
+
+class DetectorPipeline:
+    """Stage outputs of one detector, each computed at most once, on first use.
+
+    values can hold outputs computed earlier (by export, e.g. in a worker process or a previous rerun).
+    """
+
+    def __init__(self, data, correct_deadtime=True, values=None, name=""):
+        self.data = data
+        self.correct_deadtime = correct_deadtime
+        self.values = dict(values or {})
+        self.name = name
+        self.event_passes = 0
+
+    def get(self, name, width=None):
+        """Output of a stage; width is the bin width in seconds for binned stages."""
+        spec = STAGES[name]
+        if not spec.binned:
+            width = None
+        key = stage_key(name, width)
+        if key not in self.values:
+            inputs = [self.get(input_name, width) for input_name in spec.inputs]
+            extra = [width] if spec.binned else []
+            with perf.stage(key, detector=self.name, events=len(self.data) if spec.events else 0):
+                self.values[key] = spec.function(self, *inputs, *extra)
+            self.event_passes += spec.events
+        return self.values[key]
+
+    def export(self, outputs=PRECOMPUTED):
+        """The given (name, width) outputs as a dict of arrays by stage key."""
+        return {stage_key(name, width if STAGES[name].binned else None): np.asarray(self.get(name, width))
+                for name, width in outputs}
+
+
+class Pipeline:
+    """The detector pipelines of one page."""
+
+    def __init__(self, detectors):
+        self.detectors = detectors
+
+    def __len__(self):
+        return len(self.detectors)
+
+    @property
+    def datasets(self):
+        return [det.data for det in self.detectors]
+
+    def each(self, name, width=None):
+        """Output of a stage for every detector."""
+        return [det.get(name, width) for det in self.detectors]
+
+    def aligned_times(self, refine_window_ms=None):
+        """Event times of every detector on one common timebase in ms (see clockalign.py).
+
+        With refine_window_ms, every detector after the first is also shifted onto the first one
+        using their coincident events within that window.
+        """
+        times = self.each("aligned_ms")
+        if refine_window_ms is None or len(times) < 2:
+            return times
+        with perf.stage("clock refinement", window_ms=refine_window_ms):
+            return [times[0]] + [clockalign.refine(times[0], other, refine_window_ms) for other in times[1:]]
+
+    @property
+    def event_passes(self):
+        return sum(det.event_passes for det in self.detectors)
@@ -0,0 +1,50 @@
+#Confidence intervals and error bars of binned rates
+#The bins themselves (counts, live time corrected for the deadtime, rates) are stages of pipeline.py
+
+import numpy as np
+from scipy import stats
+
+ERROR_METHODS = ["None", "Poisson", "Bootstrap"]
+
+
+def poisson_interval(counts, level=0.95):
+    """Exact (Garwood) confidence interval of Poisson counts."""
+    alpha = 1 - level
+    counts = np.asarray(counts)
+    lower = np.where(counts > 0, stats.chi2.ppf(alpha / 2, 2 * counts) / 2, 0.0)
+    upper = stats.chi2.ppf(1 - alpha / 2, 2 * counts + 2) / 2
+    return lower, upper
+
+
+def bootstrap_interval(counts, level=0.95, n_boot=2000, seed=0):
+    """Percentile bootstrap interval of counts, resampling the events of the run with their total fixed.
+
+    Drawing the total number of events again from all events puts a multinomial count in the bins;
+    the interval of a bin only needs its marginal, Binomial(total, count / total). That marginal only
+    depends on the observed count, so the resamples are drawn once per distinct count value as one
+    (n_boot, n_distinct) array and mapped back onto all bins.
+    """
+    counts = np.asarray(counts)
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(len(counts)), np.zeros(len(counts))
+    distinct, inverse = np.unique(counts, return_inverse=True)
+    rng = np.random.default_rng(seed)
+    resampled = rng.binomial(total, distinct / total, size=(n_boot, len(distinct)))
+    alpha = 1 - level
+    lower, upper = np.quantile(resampled, [alpha / 2, 1 - alpha / 2], axis=0)
+    return lower[inverse], upper[inverse]
+
+
+def error_bars(rate, counts, live_s, method, mask=None):
+    """Plotly error_y for binned rates (optionally only the bins selected by mask), None without error bars."""
+    if method not in ERROR_METHODS[1:]:
+        return None
+    if method == "Bootstrap":
+        lower, upper = bootstrap_interval(counts)
+    else:
+        lower, upper = poisson_interval(counts)
+    lower, upper = lower / live_s, upper / live_s
+    if mask is not None:
+        lower, upper, rate = lower[mask], upper[mask], rate[mask]
+    return dict(type="data", symmetric=False, array=upper - rate, arrayminus=rate - lower, visible=True)
@@ -0,0 +1,161 @@
+#Replay of recorded runs as a live feed: the frames of the WebSocket server (main.py mode 5) with the original
+#time between events, sped up, as fast as possible or looped, so clients can be tested without a detector
+#Run `python replay.py ws://localhost:9090/ 100` to load-test a running server with 100 clients
+
+import asyncio
+import io
+import itertools
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import dataparser
+
+#Binary runs are numpy .npy files of dataparser.DATA_DTYPE, e.g. np.save of a parse_run result
+NPY_MAGIC = b"\x93NUMPY"
+#Frames sent per tick at most when replaying as fast as possible, so the server still answers its clients
+BATCH = 1000
+#Data lines of a text run whose host times are parsed at once
+CHUNK_LINES = 100_000
+
+
+def _text_run(stream):
+    """Host times and Arduino fields of the data lines of a text run (plain, gzip or zstd), read line by line.
+
+    Only the six fields the Arduino prints are kept: the live feed has no detector name or coincidence group.
+    """
+    text = io.BufferedReader(dataparser.open_run(stream), buffer_size=1 << 20)
+    head = [text.readline() for _ in range(dataparser.HEADER_SEARCH_LINES)]
+    header_lines = dataparser.count_header_lines(head)
+    host, dates, times, tails = [], [], [], []
+    for line in itertools.chain(head[header_lines:], text):
+        fields = line.decode("utf-8", "replace").split()
+        if len(fields) >= 8:
+            dates.append(fields[0])
+            times.append(fields[1])
+            tails.append(" ".join(fields[2:8]))
+        # Host times are parsed per chunk, so only one chunk of date and time strings is held at a time
+        if len(dates) == CHUNK_LINES:
+            host.append(dataparser.parse_host_time(np.array(dates), np.array(times)))
+            dates, times = [], []
+    host.append(dataparser.parse_host_time(np.array(dates), np.array(times)))
+    return np.concatenate(host), tails
+
+
+def _binary_run(stream):
+    """Host times and frame text of a binary run; the columns are printed the way the Arduino prints them."""
+    data = np.load(stream)
+    columns = [data[name].tolist() for name in dataparser.DATA_DTYPE.names[1:]]
+    tails = [f"{event} {ardn} {adc} {sipm:.2f} {deadtime} {temperature:.2f}"
+             for event, ardn, adc, sipm, deadtime, temperature in zip(*columns)]
+    return data["host_time_ns"], tails
+
+
+def load_run(path):
+    """Seconds since the first event and the Arduino fields (frame text after the host time) of every event.
+
+    Events without a host time cannot be placed in time and are left out.
+    """
+    with open(path, "rb") as stream:
+        if stream.read(len(NPY_MAGIC)) == NPY_MAGIC:
+            stream.seek(0)
+            host, tails = _binary_run(stream)
+        else:
+            stream.seek(0)
+            host, tails = _text_run(stream)
+    keep = np.flatnonzero(host != dataparser.MISSING_TIME)
+    if not len(keep):
+        raise ValueError(f"{path}: no events with a host time to replay")
+    # The host clock can step back a little (NTP), a replay never goes back in time
+    seconds = np.maximum.accumulate((host[keep] - host[keep[0]]) / 1e9)
+    return seconds, [tails[i] for i in keep]
+
+
+class Replay:
+    """Frames of a recorded run that are due at each moment of the replay.
+
+    speed multiplies the original pace; None sends BATCH frames per call to due(), as fast as the server can.
+    Every frame gets the host time at which it is due, like the live feed stamps events as they arrive.
+    """
+
+    def __init__(self, seconds, tails, speed=1.0, loop=False):
+        self.seconds = seconds
+        self.tails = tails
+        self.speed = speed
+        self.loop = loop
+        self.position = 0
+        self.start = None  # host time at which the current pass started
+        self.passes = 0
+        self.sent = 0
+
+    @property
+    def finished(self):
+        return not self.loop and self.position == len(self.tails)
+
+    def due(self, now):
+        """Frames due by host time now (seconds since the epoch), oldest first."""
+        if self.start is None:
+            self.start = now
+        if self.speed is None:
+            end = min(self.position + BATCH, len(self.tails))
+            stamps = np.full(end - self.position, now)
+        else:
+            end = int(np.searchsorted(self.seconds, (now - self.start) * self.speed, side="right"))
+            stamps = self.start + self.seconds[self.position:end] / self.speed
+        frames = [str(datetime.fromtimestamp(stamp)) + " " + tail + "\r\n"
+                  for stamp, tail in zip(stamps.tolist(), self.tails[self.position:end])]
+        self.position = end
+        self.sent += len(frames)
+        if self.loop and end == len(self.tails):
+            # Next pass starts one mean event interval after the last event of this one, or now if the
+            # server fell behind, rather than sending a burst of overdue frames
+            gap = self.seconds[-1] / max(len(self.seconds) - 1, 1)
+            self.start = now if self.speed is None else max(self.start + (self.seconds[-1] + gap) / self.speed, now)
+            self.position = 0
+            self.passes += 1
+        return frames
+
+
+async def _client(url, seconds, stats):
+    from tornado import websocket  # only needed by the load test
+
+    connection = await websocket.websocket_connect(url)
+    connection.write_message("StartData")
+    end = time.monotonic() + seconds
+    frames = 0
+    latency = 0.0
+    while (remaining := end - time.monotonic()) > 0:
+        try:
+            message = await asyncio.wait_for(connection.read_message(), remaining)
+        except asyncio.TimeoutError:
+            break
+        if message is None:  # the server closed the connection
+            break
+        frames += 1
+        fields = message.split(" ", 2)
+        latency += time.time() - datetime.fromisoformat(fields[0] + " " + fields[1]).timestamp()
+    connection.close()
+    stats.append((frames, latency))
+
+
+async def load_test(url, clients=100, seconds=10.0):
+    """Connect clients to a running server, ask each for the feed and count the frames received in seconds.
+
+    Returns the frames received by every client and their mean delay after the time stamped in the frame.
+    """
+    stats = []
+    await asyncio.gather(*[_client(url, seconds, stats) for _ in range(clients)])
+    frames = [count for count, _ in stats]
+    latency = sum(delay for _, delay in stats) / max(sum(frames), 1)
+    return frames, latency
+
+
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else "ws://localhost:9090/"
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+    frames, latency = asyncio.run(load_test(url, clients, seconds))
+    print(f"{clients} clients, {seconds:.0f} s: {sum(frames)} frames received, {sum(frames) / seconds:.0f} per second")
+    print(f"Frames per client: min {min(frames)}, max {max(frames)}; mean delay {latency * 1000:.1f} ms")
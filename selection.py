@@ -0,0 +1,74 @@
+#Event selection: range cuts on the parsed columns (see dataparser.DATA_DTYPE), combined per run
+#The columns that are cut on most get a sorted index, so a cut on them is two binary searches and the
+#other cuts are only evaluated on the events it leaves, instead of comparing every event with every cut
+
+import numpy as np
+
+from dataparser import MISSING_TIME
+
+#Columns worth a sorted index: the SiPM voltage (dark-count threshold) and the two time stamps (time windows)
+INDEXED_COLUMNS = ("sipm", "ardn_time_ms", "host_time_ns")
+#The index is used when its narrowest cut keeps at most 1/WIDE_CUT of the events
+WIDE_CUT = 4
+
+
+class SortedIndex:
+    """Rows of one column in order of their value."""
+
+    def __init__(self, values):
+        self.order = np.argsort(values, kind="stable")
+        self.values = values[self.order]
+
+    @property
+    def nbytes(self):
+        return self.order.nbytes + self.values.nbytes
+
+    def rows(self, low, high):
+        """Rows with low <= value <= high, in order of value."""
+        lo = np.searchsorted(self.values, low, side="left")
+        hi = np.searchsorted(self.values, high, side="right")
+        return self.order[lo:hi]
+
+
+def column_range(data, column):
+    """Smallest and largest value of a column; host times that could not be decoded are left out."""
+    values = data[column]
+    if column == "host_time_ns":
+        values = values[values != MISSING_TIME]
+    if not len(values):
+        return None
+    return values.min(), values.max()
+
+
+def select(data, cuts, indexes=None):
+    """Rows of data, in order, that pass every (column, low, high) cut, bounds included.
+
+    indexes: column -> SortedIndex of data. The narrowest indexed cut picks the candidate rows,
+    all other cuts are then checked on those rows only.
+    Returns int64 row numbers, so data[rows] is the selected subset.
+    """
+    indexes = indexes or {}
+    indexed = [(column, low, high) for column, low, high in cuts if column in indexes]
+    others = [cut for cut in cuts if cut[0] not in indexes]
+    candidates = [indexes[column].rows(low, high) for column, low, high in indexed]
+    narrowest = min(range(len(candidates)), key=lambda i: len(candidates[i])) if candidates else None
+    # A cut that keeps most events gains nothing from the index, comparing whole columns is faster then
+    if narrowest is not None and len(candidates[narrowest]) <= len(data) // WIDE_CUT:
+        # Back into time order through a mask: one pass over booleans instead of sorting the rows
+        keep = np.zeros(len(data), dtype=bool)
+        keep[candidates[narrowest]] = True
+        rows = np.flatnonzero(keep)
+        for column, low, high in others + indexed[:narrowest] + indexed[narrowest + 1:]:
+            values = data[column][rows]
+            rows = rows[(values >= low) & (values <= high)]
+        return rows
+    keep = np.ones(len(data), dtype=bool)
+    for column, low, high in cuts:
+        values = data[column]
+        keep &= (values >= low) & (values <= high)
+    return np.flatnonzero(keep)
+
+
+def cuts_key(cuts):
+    """Part of a cache key that identifies a set of cuts."""
+    return "cuts:" + ";".join(f"{column}:{low!r}-{high!r}" for column, low, high in cuts)
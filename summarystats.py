@@ -0,0 +1,229 @@
+#One-pass summary statistics for parsed runs
+#Every accumulator here can be updated chunk by chunk and merged with another one, so the cost is
+#linear in the number of events and the memory does not grow with it (runs, chunks or whole files).
+
+import numpy as np
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+#Up to this many events the exact statistics are also computed and compared to the sketch
+EXACT_LIMIT = 200000
+
+#Row labels of the statistics panel, in display order
+SUMMARY_COLUMNS = {
+    "adc": "ADC [0-1023]",
+    "sipm": "SiPM [mV]",
+    "deadtime": "Deadtime per event [ms]",
+    "temperature": "Temperature [°C]",
+    "interval": "Inter-event interval [ms]",
+}
+
+
+class RunningMoments:
+    """Count, mean, variance, min and max, merged with Chan's parallel update."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        """Add a float64 array of values."""
+        if len(values) == 0:
+            return
+        chunk = RunningMoments()
+        chunk.count = len(values)
+        chunk.mean = float(np.mean(values))
+        chunk.m2 = float(np.sum((values - chunk.mean) ** 2))
+        chunk.min = float(np.min(values))
+        chunk.max = float(np.max(values))
+        self.merge(chunk)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with relative accuracy (DDSketch-style logarithmic buckets).
+
+    Every quantile is returned within a relative error of alpha of a value at that rank. Bucket i
+    holds values in (gamma**(i-1), gamma**i], so the number of buckets only depends on the
+    range of magnitudes, not on the number of values.
+    """
+
+    def __init__(self, alpha=0.01, min_value=1e-9):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = np.log(self.gamma)
+        self.min_value = min_value
+        self.count = 0
+        self.zero_count = 0
+        self.positive = {}  # bucket index -> count
+        self.negative = {}  # bucket index of |value| -> count
+
+    def _add(self, store, values):
+        if len(values) == 0:
+            return
+        index = np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+        lowest = index.min()
+        counts = np.bincount(index - lowest)
+        for i in np.flatnonzero(counts):
+            key = int(i + lowest)
+            store[key] = store.get(key, 0) + int(counts[i])
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        positive = values[values > self.min_value]
+        negative = -values[values < -self.min_value]
+        self._add(self.positive, positive)
+        self._add(self.negative, negative)
+        self.zero_count += len(values) - len(positive) - len(negative)
+        self.count += len(values)
+
+    def merge(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantiles(self, qs):
+        """Approximate values at the given quantiles (0 to 1)."""
+        if self.count == 0:
+            return np.full(len(qs), np.nan)
+        # Buckets in increasing order of value: large negatives, zero, then positives
+        neg_keys = np.array(sorted(self.negative, reverse=True), dtype=np.int64)
+        pos_keys = np.array(sorted(self.positive), dtype=np.int64)
+        bucket_values = np.concatenate([
+            -2 * self.gamma ** neg_keys.astype(float) / (self.gamma + 1),
+            [0.0],
+            2 * self.gamma ** pos_keys.astype(float) / (self.gamma + 1),
+        ])
+        bucket_counts = np.concatenate([
+            [self.negative[k] for k in neg_keys.tolist()],
+            [self.zero_count],
+            [self.positive[k] for k in pos_keys.tolist()],
+        ])
+        cumulative = np.cumsum(bucket_counts)
+        ranks = np.asarray(qs, dtype=float) * (self.count - 1)
+        return bucket_values[np.searchsorted(cumulative, ranks, side="right")]
+
+
+class ColumnSummary:
+    """Moments and quantile sketch of one variable."""
+
+    def __init__(self, alpha=0.01):
+        self.moments = RunningMoments()
+        self.sketch = QuantileSketch(alpha)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.moments.update(values)
+        self.sketch.update(values)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+
+    def row(self, qs=QUANTILES):
+        m = self.moments
+        row = {"count": m.count, "mean": m.mean if m.count else np.nan, "variance": m.variance,
+               "min": m.min if m.count else np.nan, "max": m.max if m.count else np.nan}
+        for q, value in zip(qs, self.sketch.quantiles(qs)):
+            row[f"p{round(q * 100)}"] = value
+        return row
+
+
+class RunSummary:
+    """Single-pass summary of a parsed run (see dataparser.DATA_DTYPE), fed in chunks.
+
+    The deadtime column is cumulative, so the per-event increment is summarised; together with the
+    inter-event interval this needs the last event of the previous chunk, which is carried over.
+    """
+
+    def __init__(self, alpha=0.01):
+        self.columns = {name: ColumnSummary(alpha) for name in SUMMARY_COLUMNS}
+        self.adc_histogram = np.zeros(1024, dtype=np.int64)
+        self._last = None
+
+    def update(self, data):
+        if len(data) == 0:
+            return
+        self.columns["adc"].update(data["adc"])
+        self.columns["sipm"].update(data["sipm"])
+        self.columns["temperature"].update(data["temperature"])
+        self.adc_histogram += np.bincount(np.minimum(data["adc"], 1023), minlength=1024)
+
+        time_ms = data["ardn_time_ms"].astype(np.int64)
+        deadtime = data["deadtime"].astype(np.int64)
+        if self._last is not None:
+            time_ms = np.concatenate([[self._last[0]], time_ms])
+            deadtime = np.concatenate([[self._last[1]], deadtime])
+        self.columns["interval"].update(np.diff(time_ms))
+        self.columns["deadtime"].update(np.diff(deadtime))
+        self._last = (time_ms[-1], deadtime[-1])
+
+    def merge(self, other):
+        """Combine with the summary of another run or file (differences are not taken across runs)."""
+        for name, column in self.columns.items():
+            column.merge(other.columns[name])
+        self.adc_histogram += other.adc_histogram
+
+    @property
+    def adc_mode(self):
+        return int(np.argmax(self.adc_histogram)) if self.adc_histogram.any() else None
+
+    def table(self, qs=QUANTILES):
+        """One row of statistics per variable, as a dict of dicts keyed by the display label."""
+        return {label: self.columns[name].row(qs) for name, label in SUMMARY_COLUMNS.items()}
+
+
+def summarize(data, chunk_size=1 << 20):
+    """Summary of a whole run, read in chunks so temporaries stay bounded."""
+    summary = RunSummary()
+    for start in range(0, len(data), chunk_size):
+        summary.update(data[start:start + chunk_size])
+    return summary
+
+
+def column_values(data, name):
+    """The values summarised for one variable, for the exact statistics."""
+    if name == "interval":
+        return np.diff(data["ardn_time_ms"].astype(np.int64))
+    if name == "deadtime":
+        return np.diff(data["deadtime"].astype(np.int64))
+    return data[name]
+
+
+def exact_table(data, qs=QUANTILES):
+    """Exact statistics of a run, same layout as RunSummary.table, for small inputs."""
+    table = {}
+    for name, label in SUMMARY_COLUMNS.items():
+        values = column_values(data, name).astype(np.float64)
+        row = {"count": len(values), "mean": np.nan, "variance": np.nan, "min": np.nan, "max": np.nan}
+        if len(values):
+            row.update(mean=values.mean(), variance=values.var(ddof=1) if len(values) > 1 else np.nan,
+                       min=values.min(), max=values.max())
+        # "lower" picks the event at rank q*(n-1), which is what the sketch estimates
+        exact = np.quantile(values, qs, method="lower") if len(values) else np.full(len(qs), np.nan)
+        for q, value in zip(qs, exact):
+            row[f"p{round(q * 100)}"] = value
+        table[label] = row
+    return table
@@ -0,0 +1,189 @@
+#Time index of run files: the byte offset of every INDEX_STEP-th data line with its host and Arduino time,
+#so a time window of a long run can be parsed without reading the rest of the file
+#Runs on disk keep it as a sidecar '<run>.idx', written by the recorder or on first load
+
+import io
+import mmap
+import os
+
+import numpy as np
+
+import dataparser
+
+#Data lines between index entries; the last data line is always indexed as well
+INDEX_STEP = 256
+INDEX_DTYPE = np.dtype([("offset", np.int64), ("host_time_ns", np.int64), ("ardn_time_ms", np.int64)])
+INDEX_HEADER = "# offset host_time_ns ardn_time_ms\n"
+#Bytes scanned for line ends at a time, and the longest data line expected
+CHUNK_BYTES = 1 << 23
+MAX_LINE = 256
+
+#Time axes of a range: column of the index and of the parsed data
+AXES = {"host": "host_time_ns", "ardn": "ardn_time_ms"}
+
+
+def index_path(run_path):
+    return run_path + ".idx"
+
+
+def is_plain(buffer):
+    """Compressed runs cannot be sliced by byte offset, see dataparser.open_run."""
+    head = bytes(buffer[:4])
+    return not (head.startswith(dataparser.GZIP_MAGIC) or head == dataparser.ZSTD_MAGIC)
+
+
+def _line_starts(buffer):
+    """Offsets at which lines start, scanning for newlines a chunk at a time to bound memory."""
+    view = np.frombuffer(buffer, dtype=np.uint8)
+    starts = [np.zeros(1, dtype=np.int64)]
+    for lo in range(0, len(view), CHUNK_BYTES):
+        starts.append(np.flatnonzero(view[lo:lo + CHUNK_BYTES] == ord("\n")) + lo + 1)
+    starts = np.concatenate(starts)
+    return starts[starts < len(view)]
+
+
+def _entries(buffer, offsets):
+    """Index entries of the data lines starting at offsets; lines that do not decode are left out."""
+    rows = []
+    for offset in offsets:
+        fields = bytes(buffer[offset:offset + MAX_LINE]).split(b"\n", 1)[0].split()
+        if len(fields) >= 4 and fields[3].isdigit():
+            rows.append((offset, fields[0].decode("ascii", "replace"), fields[1].decode("ascii", "replace"), int(fields[3])))
+    index = np.empty(len(rows), dtype=INDEX_DTYPE)
+    if rows:
+        offsets, dates, times, ardn = zip(*rows)
+        index["offset"] = offsets
+        index["host_time_ns"] = dataparser.parse_host_time(np.array(dates), np.array(times))
+        index["ardn_time_ms"] = ardn
+    return index
+
+
+def build_index(buffer, step=INDEX_STEP):
+    """Index of a plain-text run held in buffer (bytes, memoryview or mmap)."""
+    starts = _line_starts(buffer)
+    head_end = starts[dataparser.HEADER_SEARCH_LINES] if len(starts) > dataparser.HEADER_SEARCH_LINES else len(buffer)
+    header_lines = dataparser.count_header_lines(bytes(buffer[:head_end]).splitlines(keepends=True))
+    data_starts = starts[header_lines:]
+    if not len(data_starts):
+        return np.empty(0, dtype=INDEX_DTYPE)
+    sample = data_starts[::step]
+    if sample[-1] != data_starts[-1]:
+        sample = np.append(sample, data_starts[-1])
+    return _entries(buffer, sample)
+
+
+def read_index(path):
+    rows = np.loadtxt(path, dtype=np.int64, comments="#", ndmin=2)
+    index = np.empty(len(rows), dtype=INDEX_DTYPE)
+    for i, name in enumerate(INDEX_DTYPE.names):
+        index[name] = rows[:, i] if len(rows) else []
+    return index
+
+
+def write_index(path, index):
+    with open(path, "w") as sidecar:
+        sidecar.write(INDEX_HEADER)
+        np.savetxt(sidecar, np.column_stack([index[name] for name in INDEX_DTYPE.names]), fmt="%d")
+
+
+def matches(index, buffer):
+    """Whether index still describes the run held in buffer: its first, middle and last entries point at
+    the start of a line within the run with the Arduino time of the entry. A run replaced by another one
+    under the same name fails this, a run that only grew since passes."""
+    for entry in index[[0, len(index) // 2, -1]] if len(index) else []:
+        offset = int(entry["offset"])
+        if offset >= len(buffer) or (offset and buffer[offset - 1:offset] != b"\n"):
+            return False
+        fields = bytes(buffer[offset:offset + MAX_LINE]).split(b"\n", 1)[0].split()
+        if len(fields) < 4 or not fields[3].isdigit() or int(fields[3]) != entry["ardn_time_ms"]:
+            return False
+    return True
+
+
+def _load_index(run_path, buffer):
+    sidecar = index_path(run_path)
+    if os.path.exists(sidecar):
+        index = read_index(sidecar)
+        if matches(index, buffer):
+            return index
+    index = build_index(buffer)
+    write_index(sidecar, index)
+    return index
+
+
+def _mapped(run):
+    """Read-only memory map of an open run file (mmap cannot map an empty file)."""
+    if os.fstat(run.fileno()).st_size == 0:
+        return io.BytesIO(b"").getbuffer()
+    return mmap.mmap(run.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def load_index(run_path):
+    """Index of a run on disk: its sidecar if it still matches the run (see matches), otherwise built now
+    and saved as the sidecar."""
+    with open(run_path, "rb") as run, _mapped(run) as buffer:
+        return _load_index(run_path, buffer)
+
+
+def byte_range(index, size, axis, start, end):
+    """Offsets [lo, hi) of the data lines that can lie between start and end on the axis ("host" or "ardn").
+
+    lo is the last indexed line before start and hi the first indexed line after end, so the slice is at most
+    INDEX_STEP lines longer on each side than the window. Times are assumed to increase through the file.
+    """
+    if not len(index):
+        return 0, size
+    times = index[AXES[axis]]
+    first = np.searchsorted(times, start, side="left") - 1
+    last = np.searchsorted(times, end, side="right")
+    lo = index["offset"][max(first, 0)]
+    hi = index["offset"][last] if last < len(index) else size
+    return int(lo), int(hi)
+
+
+def trim(data, axis, start, end):
+    """Events of parsed data with start <= time <= end on the axis."""
+    column = data[AXES[axis]]
+    return data[(column >= start) & (column <= end)]
+
+
+def parse_range(buffer, index, axis, start, end):
+    """Parse only the events between start and end of a plain-text run held in buffer."""
+    lo, hi = byte_range(index, len(buffer), axis, start, end)
+    # The first line of the slice lies before start (or is the run's first line, which is skipped anyway),
+    # so dropping the first row in parse_run loses nothing inside the window
+    return trim(dataparser.parse_run(io.BytesIO(buffer[lo:hi])), axis, start, end)
+
+
+def load_range(run_path, axis, start, end):
+    """parse_range of a run on disk, reading only the slice through a memory map."""
+    with open(run_path, "rb") as run, _mapped(run) as buffer:
+        return parse_range(buffer, _load_index(run_path, buffer), axis, start, end)
+
+
+class IndexWriter:
+    """Sidecar index written while recording: call line() with the file offset and text of each data line,
+    after writing the line to data_file."""
+
+    def __init__(self, run_path, data_file=None, step=INDEX_STEP):
+        self.file = open(index_path(run_path), "w")
+        self.file.write(INDEX_HEADER)
+        self.data_file = data_file
+        self.step = step
+        self.count = 0
+
+    def line(self, offset, line):
+        if self.count % self.step == 0:
+            fields = line.split()
+            if len(fields) >= 4 and fields[3].isdigit():
+                host = dataparser.parse_host_time(np.array([fields[0]]), np.array([fields[1]]))[0]
+                # The line reaches the run before its entry reaches the sidecar, so a reader of a run
+                # being recorded never finds an entry past the end of the run (see matches)
+                if self.data_file is not None:
+                    self.data_file.flush()
+                self.file.write(f"{offset} {host} {fields[3]}\n")
+                self.file.flush()
+        self.count += 1
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,59 @@
+#Event rates by wall-clock time: folded onto the time of day, or in calendar bins (hours, days)
+#Works on the int64 host_time_ns column of a parsed run, so months of data are a few bincounts
+
+import numpy as np
+
+from dataparser import MISSING_TIME
+
+NS_PER_SECOND = 10**9
+NS_PER_MINUTE = 60 * NS_PER_SECOND
+NS_PER_DAY = 86400 * NS_PER_SECOND
+
+#Intervals between events longer than this are treated as the recorder being off, not as live time
+MAX_GAP_NS = 10 * NS_PER_MINUTE
+
+
+def valid_host_time(data):
+    """Sorted host times of the events whose timestamp could be decoded."""
+    host = data["host_time_ns"]
+    return np.sort(host[host != MISSING_TIME])
+
+
+def _exposure(host, bins, nbins, max_gap):
+    """Observed seconds per bin: each inter-event interval shorter than max_gap is credited to the bin it starts in."""
+    gaps = np.diff(host)
+    live = gaps < max_gap
+    return np.bincount(bins[:-1][live], weights=gaps[live], minlength=nbins)[:nbins] / NS_PER_SECOND
+
+
+def time_of_day_rate(host, bin_minutes=60, max_gap=MAX_GAP_NS):
+    """Rate by time of day, summed over all days of the run.
+
+    Returns bin start in hours, event counts, observed seconds and rate in Hz for each bin.
+    """
+    width = int(bin_minutes * NS_PER_MINUTE)
+    nbins = int(np.ceil(NS_PER_DAY / width))
+    bins = (host % NS_PER_DAY) // width
+    counts = np.bincount(bins, minlength=nbins)[:nbins]
+    exposure = _exposure(host, bins, nbins, max_gap)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(exposure > 0, counts / exposure, np.nan)
+    return np.arange(nbins) * bin_minutes / 60.0, counts, exposure, rate
+
+
+def calendar_rate(host, bin_minutes=24 * 60, max_gap=MAX_GAP_NS):
+    """Rate in consecutive calendar bins (e.g. hours or days) from the first to the last event.
+
+    Bins are aligned to midnight of the first day. Returns bin start as datetime64[ns], event counts,
+    observed seconds and rate in Hz for each bin.
+    """
+    width = int(bin_minutes * NS_PER_MINUTE)
+    origin = host[0] // NS_PER_DAY * NS_PER_DAY
+    bins = (host - origin) // width
+    nbins = int(bins[-1]) + 1
+    counts = np.bincount(bins, minlength=nbins)
+    exposure = _exposure(host, bins, nbins, max_gap)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(exposure > 0, counts / exposure, np.nan)
+    starts = (origin + np.arange(nbins, dtype=np.int64) * width).view("datetime64[ns]")
+    return starts, counts, exposure, rate